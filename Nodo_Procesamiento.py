@@ -1,26 +1,57 @@
 import socket
+import threading
+import collections
+import json
+import hashlib
+import os
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
+from protocolo import LATIDO, MSG_ANILLO, MSG_BANDAS, MSG_ERROR_TAREA, MSG_FRAMES_CODEC, MSG_LOTE, MSG_SEGMENTOS, MSG_SLOTS, desempaquetar_lote, enviar_paquete, es_latido, partes_lote, recibir_paquete
+from segmentos import EscritorSegmento, abrir_segmento
+from codificacion import codificar_frame, decodificar_frame
+from memoria_compartida import ENTRADA_SLOT, AnilloFrames
+from bandas import leer_banda
 
 SERVIDOR_HOST = 'localhost'
 SERVIDOR_PORT = 8080
 JPEG_QUALITY = 90
 VIGNETTE_SIGMA = 0.6
 BAR_HEIGHT_RATIO = 0.12
+NUM_WORKERS = os.cpu_count() or 1
+VENTANA_MAX = None
+LOTE_MAX_BYTES = 512 * 1024
+LOTE_MAX_ESPERA = 0.002
+TIMEOUT_SERVIDOR = 10.0
+FRAMES_LOTE_FILTRO = 8
+MAX_FILTROS_CACHE = 8
+DIRECTORIO_CACHE_FILTROS = None
+MEMORIA_COMPARTIDA = True
 
 class CineFilter:
-    def __init__(self, width, height):
+    def __init__(self, width, height, mascara_8u=None):
         self.width = width
         self.height = height
-        self.vignette_mask = self._create_vignette_mask(width, height)
         self.lut_contrast = self._create_s_curve_lut()
+        
+        self.bar_height = int(height * BAR_HEIGHT_RATIO)
+        self.lut_cine = self._create_cinematic_lut(self.lut_contrast)
+        
+        # Solo se conserva la viñeta en punto fijo de 8 bits; `mascara_8u` (un canal) permite
+        # partir de una ya calculada (caché en disco) en lugar de recalcularla
+        if mascara_8u is None:
+            mascara_8u = self._create_vignette_mask_8u(self._create_vignette_mask(width, height))
+        self.vignette_mask_8u = cv2.merge([mascara_8u, mascara_8u, mascara_8u])
+        
+        # El filtro se comparte entre workers: cada hilo tiene su propio buffer de salida por lotes
+        self._buffers = threading.local()
     
     def _create_s_curve_lut(self):
-        lut = np.zeros((256, 1), dtype='uint8')
-        for i in range(256):
-            v = 255.0 / (1 + np.exp(-((i - 128) / 32.0)))
-            lut[i][0] = int(v)
-        return lut
+        valores = np.arange(256, dtype=np.float64)
+        curva = 255.0 / (1 + np.exp(-((valores - 128) / 32.0)))
+        return curva.astype(np.uint8).reshape(256, 1)
     
     def _create_vignette_mask(self, width, height):
         kernel_x = cv2.getGaussianKernel(width, width * VIGNETTE_SIGMA)
@@ -31,94 +62,379 @@ class CineFilter:
         
         return mask
     
-    def apply_teal_orange(self, frame):
-        b, g, r = cv2.split(frame)
-        
-        b = b.astype(float) * 1.15
-        r = r.astype(float) * 1.15
-        g = g.astype(float) * 0.95
-        
-        merged = cv2.merge([b, g, r])
-        merged = np.clip(merged, 0, 255).astype(np.uint8)
-        
-        return merged
+    def _create_cinematic_lut(self, lut_contrast):
+        # Ganancia teal-orange + clip + curva S combinadas en una LUT por canal (B, G, R)
+        valores = np.arange(256, dtype=np.float64)
+        lut = np.zeros((256, 1, 3), dtype=np.uint8)
+        for canal, ganancia in enumerate((1.15, 0.95, 1.15)):
+            indices = np.clip(valores * ganancia, 0, 255).astype(np.uint8)
+            lut[:, 0, canal] = lut_contrast[indices, 0]
+        return lut
     
-    def apply_cinematic_style(self, frame):
-        frame_colored = self.apply_teal_orange(frame)
-        
-        frame_contrast = cv2.LUT(frame_colored, self.lut_contrast)
+    def _create_vignette_mask_8u(self, mask):
+        # Máscara en punto fijo (x/255); se replica en 3 canales para cv2.multiply
+        return np.round(mask * 255).astype(np.uint8)
+    
+    def mascara_8u(self):
+        return self.vignette_mask_8u[:, :, 0]
+    
+    def _buffer_lote(self, num_frames, forma):
+        buffer = getattr(self._buffers, 'salida', None)
+        if buffer is None or len(buffer) < num_frames or buffer.shape[1:] != forma:
+            buffer = np.empty((num_frames,) + forma, dtype=np.uint8)
+            self._buffers.salida = buffer
+        return buffer
+    
+    def apply_cinematic_style_lote(self, frames, salida=None, fila=0):
+        # `frames` es un array (N, H, W, 3) o una lista de frames. Sin `salida` el resultado
+        # se escribe en un buffer del hilo que se reutiliza: vale hasta su siguiente llamada.
+        # Con `fila` los frames son una banda horizontal que empieza en esa fila del frame completo
+        num_frames = len(frames)
+        alto, ancho = frames[0].shape[:2]
+        if ancho != self.width or fila + alto > self.height:
+            raise ValueError(f"Banda {ancho}x{alto} en la fila {fila} fuera del frame {self.width}x{self.height}")
+        if salida is None:
+            salida = self._buffer_lote(num_frames, frames[0].shape)
+        salida = salida[:num_frames]
         
-        frame_float = frame_contrast.astype(float)
-        frame_float[:, :, 0] *= self.vignette_mask
-        frame_float[:, :, 1] *= self.vignette_mask
-        frame_float[:, :, 2] *= self.vignette_mask
-        frame_final = frame_float.astype(np.uint8)
+        # cv2.rectangle rellena de forma inclusiva: la barra superior cubre bar_height + 1 filas.
+        # Los límites se pasan a coordenadas de la banda
+        inicio = min(max(self.bar_height + 1 - fila, 0), alto)
+        fin = min(max(self.height - self.bar_height - fila, inicio), alto)
+        salida[:, :inicio] = 0
+        salida[:, fin:] = 0
         
-        bar_height = int(self.height * BAR_HEIGHT_RATIO)
-        cv2.rectangle(frame_final, (0, 0), (self.width, bar_height), (0, 0, 0), -1)
-        cv2.rectangle(frame_final, (0, self.height - bar_height), (self.width, self.height), (0, 0, 0), -1)
+        if fin > inicio:
+            mascara = self.vignette_mask_8u[fila + inicio:fila + fin]
+            for frame, frame_final in zip(frames, salida):
+                zona = frame_final[inicio:fin]
+                cv2.LUT(frame[inicio:fin], self.lut_cine, dst=zona)
+                cv2.multiply(zona, mascara, dst=zona, scale=1.0 / 255)
         
-        return frame_final
+        return salida
+    
+    def apply_cinematic_style(self, frame, fila=0):
+        frame_final = np.empty((1,) + frame.shape, dtype=np.uint8)
+        return self.apply_cinematic_style_lote((frame,), frame_final, fila)[0]
 
-def recibir_bytes_exactos(conn, num_bytes):
-    data = b""
-    while len(data) < num_bytes:
-        try:
-            packet = conn.recv(num_bytes - len(data))
-            if not packet:
-                return None
-            data += packet
-        except Exception as e:
-            print(f"[ERROR] Error recibiendo bytes: {e}")
+class CacheFiltros:
+    # LRU de filtros precalculados por resolución y parámetros: el servidor puede intercalar
+    # frames de sesiones con resoluciones distintas. Con `directorio` las máscaras se
+    # guardan en disco y un nodo nuevo arranca con ellas ya calculadas
+    def __init__(self, capacidad, directorio=None):
+        self.capacidad = max(1, capacidad)
+        self.directorio = directorio
+        self.filtros = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.desde_disco = 0
+        self.tiempos_construccion = {}
+    
+    def _ruta(self, clave):
+        width, height, sigma, ratio = clave
+        return os.path.join(self.directorio, f"cinefilter_{width}x{height}_{sigma}_{ratio}.npz")
+    
+    def _cargar(self, clave):
+        if self.directorio is None:
+            return None
+        ruta = self._ruta(clave)
+        if not os.path.exists(ruta):
             return None
-    return data
-
-def recibir_paquete_con_id(conn):
-    try:
-        size_data = recibir_bytes_exactos(conn, 4)
-        if not size_data:
-            return None, None
-        total_size = int.from_bytes(size_data, byteorder='big')
-        
-        payload = b""
-        while len(payload) < total_size:
-            packet = conn.recv(min(4096, total_size - len(payload)))
-            if not packet:
-                return None, None
-            payload += packet
-        
-        frame_id = int.from_bytes(payload[:4], byteorder='big')
-        img_data = payload[4:]
-        
-        nparr = np.frombuffer(img_data, np.uint8)
-        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
         
-        if frame is None:
-            print(f"[ERROR] No se pudo decodificar frame ID {frame_id}")
-            return None, None
+        width, height = clave[:2]
+        try:
+            with np.load(ruta) as datos:
+                mascara_8u = datos['vignette_mask_8u']
+            if mascara_8u.shape != (height, width) or mascara_8u.dtype != np.uint8:
+                raise ValueError("dimensiones o tipo inesperados")
+            return CineFilter(width, height, mascara_8u)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[WARNING] Caché de filtro inválida en {ruta}: {e}")
+            return None
+    
+    def _guardar(self, clave, filtro):
+        if self.directorio is None:
+            return
+        ruta = self._ruta(clave)
+        temporal = f"{ruta}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            os.makedirs(self.directorio, exist_ok=True)
+            with open(temporal, 'wb') as f:
+                np.savez(f, vignette_mask_8u=filtro.mascara_8u())
+            os.replace(temporal, ruta)
+        except OSError as e:
+            print(f"[WARNING] No se pudo guardar la caché de filtro en {ruta}: {e}")
+            if os.path.exists(temporal):
+                os.unlink(temporal)
+    
+    def obtener(self, width, height):
+        clave = (width, height, VIGNETTE_SIGMA, BAR_HEIGHT_RATIO)
+        with self.lock:
+            filtro = self.filtros.get(clave)
+            if filtro is not None:
+                self.filtros.move_to_end(clave)
+                self.aciertos += 1
+                return filtro
+            self.fallos += 1
         
-        return frame_id, frame
+        # Se construye fuera del lock para no frenar a los workers que usan otras resoluciones
+        inicio = time.perf_counter()
+        filtro = self._cargar(clave)
+        desde_disco = filtro is not None
+        if not desde_disco:
+            filtro = CineFilter(width, height)
+            self._guardar(clave, filtro)
+        duracion = time.perf_counter() - inicio
         
-    except Exception as e:
-        print(f"[ERROR] Error recibiendo paquete: {e}")
-        return None, None
+        with self.lock:
+            if desde_disco:
+                self.desde_disco += 1
+            self.tiempos_construccion[(width, height)] = duracion
+            filtro = self.filtros.setdefault(clave, filtro)
+            self.filtros.move_to_end(clave)
+            while len(self.filtros) > self.capacidad:
+                self.filtros.popitem(last=False)
+            en_cache = len(self.filtros)
+            consultas = self.aciertos + self.fallos
+            aciertos = self.aciertos
+        # Cada construcción es un fallo: la tasa acumulada se informa aquí, sin esperar a la desconexión
+        origen = "cargado de disco" if desde_disco else "calculado"
+        print(f"[INFO] Filtro cinemático para {width}x{height} {origen} en {duracion * 1000:.1f} ms ({en_cache} en caché; {aciertos}/{consultas} aciertos, {aciertos / consultas * 100:.1f}%)")
+        return filtro
+    
+    def estadisticas(self):
+        with self.lock:
+            consultas = self.aciertos + self.fallos
+            return {
+                'aciertos': self.aciertos,
+                'fallos': self.fallos,
+                'tasa_aciertos': self.aciertos / consultas if consultas else 0.0,
+                'desde_disco': self.desde_disco,
+                'en_cache': len(self.filtros),
+                'construccion_ms': {f"{w}x{h}": t * 1000 for (w, h), t in self.tiempos_construccion.items()},
+            }
 
-def enviar_paquete_con_id(conn, frame_id, frame):
-    try:
-        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
-        img_bytes = buffer.tobytes()
-        
-        id_bytes = frame_id.to_bytes(4, byteorder='big')
-        payload = id_bytes + img_bytes
-        
-        size_bytes = len(payload).to_bytes(4, byteorder='big')
-        conn.sendall(size_bytes + payload)
-        
-        return True
+class ProcesadorFrames:
+    def __init__(self, conn, num_workers):
+        self.conn = conn
+        self.num_workers = num_workers
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.slots = threading.BoundedSemaphore(num_workers * 2)
+        self.filtros = CacheFiltros(MAX_FILTROS_CACHE, DIRECTORIO_CACHE_FILTROS)
+        self.anillo = None
+        self.frames_procesados = 0
+        # Resultados (id, datos) y, como bytes, mensajes de control para el servidor
+        self.cola_resultados = queue.Queue()
+        self.hilo_envio = threading.Thread(target=self._bucle_envio, daemon=True)
+        self.hilo_envio.start()
+    
+    def obtener_filtro(self, frame):
+        h, w = frame.shape[:2]
+        return self.filtros.obtener(w, h)
+    
+    def enviar(self, frame_id, img_data, tipo=MSG_LOTE, slot_anillo=None):
+        if tipo == MSG_SEGMENTOS:
+            procesar = self._procesar_segmento
+        elif tipo == MSG_FRAMES_CODEC:
+            procesar = self._procesar_codificado
+        elif tipo == MSG_BANDAS:
+            procesar = self._procesar_banda
+        else:
+            procesar = self._procesar
         
-    except Exception as e:
-        print(f"[ERROR] Error enviando paquete: {e}")
+        self.slots.acquire()
+        try:
+            self.executor.submit(procesar, frame_id, img_data, slot_anillo)
+        except Exception:
+            self.slots.release()
+            raise
+    
+    def _entregar(self, frame_id, resultado, slot_anillo):
+        # Si el frame llegó por memoria compartida el resultado se deja en su mismo slot
+        # y la respuesta va vacía; si no cabe, viaja por el socket
+        if slot_anillo is not None and self.anillo.cabe(memoryview(resultado).nbytes):
+            self.anillo.escribir(slot_anillo, resultado)
+            resultado = memoryview(b'')
+        self.cola_resultados.put((frame_id, resultado))
+    
+    def _notificar_error(self, frame_id, mensaje):
+        # Toda tarea recibida tiene respuesta: si falla, el servidor recibe el motivo y
+        # libera su hueco en la ventana en lugar de esperar a que venza el plazo
+        print(f"[ERROR] {mensaje}")
+        self.cola_resultados.put(b''.join(partes_lote([(frame_id, mensaje.encode('utf-8'))], MSG_ERROR_TAREA)))
+    
+    def _procesar(self, frame_id, img_data, slot_anillo=None):
+        try:
+            nparr = np.frombuffer(img_data, np.uint8)
+            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+            
+            if frame is None:
+                self._notificar_error(frame_id, f"No se pudo decodificar frame ID {frame_id}")
+                return
+            
+            frame_procesado = self.obtener_filtro(frame).apply_cinematic_style(frame)
+            
+            ok, buffer = cv2.imencode('.jpg', frame_procesado, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if not ok:
+                self._notificar_error(frame_id, f"No se pudo codificar frame ID {frame_id}")
+                return
+            
+            self._entregar(frame_id, buffer, slot_anillo)
+        except Exception as e:
+            self._notificar_error(frame_id, f"Error procesando frame ID {frame_id}: {e}")
+        finally:
+            self.slots.release()
+    
+    def _procesar_codificado(self, frame_id, datos, slot_anillo=None):
+        # El resultado vuelve con el mismo codec y calidad con que llegó el frame
+        try:
+            frame, codec, calidad = decodificar_frame(datos)
+            frame_procesado = self.obtener_filtro(frame).apply_cinematic_style(frame)
+            self._entregar(frame_id, codificar_frame(frame_procesado, codec, calidad), slot_anillo)
+        except Exception as e:
+            self._notificar_error(frame_id, f"Error procesando frame ID {frame_id}: {e}")
+        finally:
+            self.slots.release()
+    
+    def _procesar_banda(self, banda_id, datos, slot_anillo=None):
+        # Banda horizontal de un frame mayor: se usa el filtro del frame completo
+        # desplazado a la fila en que empieza la banda
+        try:
+            fila, alto_total, cuerpo = leer_banda(datos)
+            banda, codec, calidad = decodificar_frame(cuerpo)
+            filtro = self.filtros.obtener(banda.shape[1], alto_total)
+            banda_procesada = filtro.apply_cinematic_style(banda, fila)
+            self._entregar(banda_id, codificar_frame(banda_procesada, codec, calidad), slot_anillo)
+        except Exception as e:
+            self._notificar_error(banda_id, f"Error procesando banda ID {banda_id}: {e}")
+        finally:
+            self.slots.release()
+    
+    def _procesar_segmento(self, segmento_id, datos, slot_anillo=None):
+        escritor = None
+        try:
+            with abrir_segmento(datos) as cap:
+                fps = cap.get(cv2.CAP_PROP_FPS)
+                # Los frames se decodifican directamente en una pila (N, H, W, 3) y se
+                # filtran de FRAMES_LOTE_FILTRO en FRAMES_LOTE_FILTRO
+                entrada = None
+                terminado = False
+                while not terminado:
+                    leidos = 0
+                    while leidos < FRAMES_LOTE_FILTRO:
+                        ret, frame = cap.read(None if entrada is None else entrada[leidos])
+                        if not ret:
+                            terminado = True
+                            break
+                        if entrada is None:
+                            entrada = np.empty((FRAMES_LOTE_FILTRO,) + frame.shape, dtype=np.uint8)
+                            entrada[0] = frame
+                        leidos += 1
+                    if not leidos:
+                        break
+                    
+                    filtro = self.obtener_filtro(entrada[0])
+                    if escritor is None:
+                        escritor = EscritorSegmento(fps, entrada.shape[2], entrada.shape[1])
+                    for frame_procesado in filtro.apply_cinematic_style_lote(entrada[:leidos]):
+                        escritor.escribir(frame_procesado)
+            
+            if escritor is None:
+                self._notificar_error(segmento_id, f"Segmento ID {segmento_id} sin frames")
+                return
+            
+            frames = escritor.frames
+            self._entregar(segmento_id, memoryview(escritor.terminar()), slot_anillo)
+            escritor = None
+            print(f"[INFO] Segmento ID {segmento_id} procesado ({frames} frames)")
+        except Exception as e:
+            self._notificar_error(segmento_id, f"Error procesando segmento ID {segmento_id}: {e}")
+            if escritor is not None:
+                escritor.descartar()
+        finally:
+            self.slots.release()
+    
+    def responder_latido(self):
+        # La respuesta sale por el hilo de envío para no intercalarse con un lote a medio enviar
+        self.cola_resultados.put(LATIDO)
+    
+    def adjuntar_anillo(self, oferta):
+        # Adjuntarse solo es posible en la misma máquina que el servidor; la respuesta
+        # le indica si puede pasar los frames por memoria compartida
+        try:
+            self.anillo = AnilloFrames.abrir(oferta['nombre'], int(oferta['slots']), int(oferta['tam_slot']))
+            print(f"[INFO] Memoria compartida con el servidor: {self.anillo.num_slots} slots de {self.anillo.tam_slot // (1024 * 1024)} MB")
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[INFO] Sin memoria compartida con el servidor ({e}); se usa TCP")
+        respuesta = json.dumps({'ok': self.anillo is not None}).encode('utf-8')
+        self.cola_resultados.put(bytes([MSG_ANILLO]) + respuesta)
+    
+    def _enviar(self, *partes):
+        if enviar_paquete(self.conn, *partes):
+            return True
+        try:
+            self.conn.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         return False
+    
+    def _bucle_envio(self):
+        while True:
+            resultado = self.cola_resultados.get()
+            if resultado is None:
+                return
+            
+            if isinstance(resultado, bytes):
+                if not self._enviar(resultado):
+                    print("[ERROR] Error enviando mensaje de control")
+                    return
+                continue
+            
+            lote = [resultado]
+            tam_lote = resultado[1].nbytes
+            limite = time.monotonic() + LOTE_MAX_ESPERA
+            while tam_lote < LOTE_MAX_BYTES:
+                restante = limite - time.monotonic()
+                try:
+                    if restante > 0:
+                        resultado = self.cola_resultados.get(timeout=restante)
+                    else:
+                        resultado = self.cola_resultados.get_nowait()
+                except queue.Empty:
+                    break
+                if resultado is None or isinstance(resultado, bytes):
+                    self.cola_resultados.put(resultado)
+                    break
+                lote.append(resultado)
+                tam_lote += resultado[1].nbytes
+            
+            if not self._enviar(*partes_lote(lote)):
+                print(f"[ERROR] Error enviando lote de {len(lote)} frames")
+                return
+            
+            self.frames_procesados += len(lote)
+            print(f"[INFO] Lote de {len(lote)} frames completado (Total: {self.frames_procesados})")
+    
+    def cerrar(self):
+        self.executor.shutdown(wait=True)
+        self.cola_resultados.put(None)
+        self.hilo_envio.join()
+        if self.anillo is not None:
+            self.anillo.cerrar()
+
+def huella_filtro():
+    # Hash de lo que determina la salida: la LUT, los parámetros y el resultado del filtro
+    # sobre un frame de referencia con todos los niveles (cubre la viñeta y las barras).
+    # Cualquier cambio de CineFilter que altere la salida cambia la huella, y el servidor
+    # no reutiliza resultados cacheados con la anterior
+    referencia = (np.arange(36 * 64 * 3) % 256).astype(np.uint8).reshape(36, 64, 3)
+    filtro = CineFilter(64, 36)
+    h = hashlib.blake2b(digest_size=8)
+    h.update(filtro.lut_cine.tobytes())
+    h.update(filtro.apply_cinematic_style(referencia).tobytes())
+    h.update(json.dumps([VIGNETTE_SIGMA, BAR_HEIGHT_RATIO, JPEG_QUALITY]).encode('utf-8'))
+    return f"cine {h.hexdigest()}"
 
 def main():
     print("="*60)
@@ -131,37 +447,62 @@ def main():
         print(f"[INFO] Conectando a {SERVIDOR_HOST}:{SERVIDOR_PORT}...")
         sock.connect((SERVIDOR_HOST, SERVIDOR_PORT))
         
-        sock.sendall(b"NODO".ljust(10))
-        print(f"[INFO] Conectado exitosamente al servidor central")
+        sock.sendall(b"NODO_V2".ljust(10))
+        capacidades = {'workers': NUM_WORKERS, 'nucleos': os.cpu_count(), 'lotes': True, 'latidos': True, 'segmentos': True, 'codecs': True, 'bandas': True, 'memoria_compartida': MEMORIA_COMPARTIDA}
+        # Huella del filtro: el servidor solo reutiliza resultados cacheados con la misma
+        capacidades['filtro'] = huella_filtro()
+        if VENTANA_MAX is not None:
+            capacidades['ventana_max'] = VENTANA_MAX
+        enviar_paquete(sock, json.dumps(capacidades).encode('utf-8'))
+        print(f"[INFO] Conectado exitosamente al servidor central ({NUM_WORKERS} workers)")
         
-        cine_filter = None
-        frames_procesados = 0
+        if NUM_WORKERS > 1:
+            cv2.setNumThreads(1)
+        
+        procesador = ProcesadorFrames(sock, NUM_WORKERS)
         
         print("[INFO] Esperando frames para procesar...")
         
-        while True:
-            frame_id, frame = recibir_paquete_con_id(sock)
-            
-            if frame is None:
-                print("[INFO] Servidor cerró la conexión")
-                break
-            
-            if cine_filter is None:
-                h, w = frame.shape[:2]
-                cine_filter = CineFilter(w, h)
-                print(f"[INFO] Filtro cinemático configurado para resolución {w}x{h}")
-            
-            print(f"[INFO] Procesando Frame ID: {frame_id}")
-            frame_procesado = cine_filter.apply_cinematic_style(frame)
-            
-            if not enviar_paquete_con_id(sock, frame_id, frame_procesado):
-                print(f"[ERROR] Error enviando frame ID {frame_id}")
-                break
-            
-            frames_procesados += 1
-            print(f"[INFO] Frame ID: {frame_id} completado (Total: {frames_procesados})")
+        try:
+            while True:
+                payload = recibir_paquete(sock)
+                
+                if payload is None:
+                    print("[INFO] Servidor cerró la conexión")
+                    break
+                
+                if es_latido(payload):
+                    # El servidor envía latidos: desde ahora su silencio indica una caída
+                    sock.settimeout(TIMEOUT_SERVIDOR)
+                    procesador.responder_latido()
+                    continue
+                
+                if payload[0] == MSG_ANILLO:
+                    procesador.adjuntar_anillo(json.loads(bytes(payload[1:]).decode('utf-8')))
+                    continue
+                
+                lote = desempaquetar_lote(payload)
+                if payload[0] == MSG_SLOTS:
+                    # Los datos están en el anillo: cada entrada trae su tipo y su slot
+                    entradas = [(frame_id,) + ENTRADA_SLOT.unpack(entrada) for frame_id, entrada in lote]
+                    tipo = entradas[0][1]
+                    print(f"[INFO] Lote recibido por memoria compartida: {len(lote)} {'segmentos' if tipo == MSG_SEGMENTOS else 'frames'} (IDs {lote[0][0]}..{lote[-1][0]})")
+                    for frame_id, tipo, slot in entradas:
+                        procesador.enviar(frame_id, procesador.anillo.leer(slot), tipo, slot)
+                    continue
+                
+                tipo = payload[0]
+                print(f"[INFO] Lote recibido: {len(lote)} {'segmentos' if tipo == MSG_SEGMENTOS else 'frames'} (IDs {lote[0][0]}..{lote[-1][0]})")
+                for frame_id, img_data in lote:
+                    procesador.enviar(frame_id, img_data, tipo)
+        finally:
+            procesador.cerrar()
+        
+        print(f"[INFO] Total de frames procesados: {procesador.frames_procesados}")
         
-        print(f"[INFO] Total de frames procesados: {frames_procesados}")
+        estadisticas = procesador.filtros.estadisticas()
+        construccion = ", ".join(f"{resolucion} {ms:.1f} ms" for resolucion, ms in estadisticas['construccion_ms'].items())
+        print(f"[INFO] Caché de filtros: {estadisticas['aciertos']} aciertos, {estadisticas['fallos']} fallos ({estadisticas['tasa_aciertos'] * 100:.1f}% aciertos), {estadisticas['desde_disco']} cargados de disco; construcción: {construccion or '-'}")
         
     except ConnectionRefusedError:
         print("[ERROR] Conexión rechazada. Verifica que el servidor esté ejecutándose.")
@@ -0,0 +1,47 @@
+import math
+import struct
+import numpy as np
+from codificacion import CODECS_SIN_COMPRESION, codificar_frame, decodificar_frame, leer_cabecera, partes_recorte
+
+# Un frame grande se reparte en bandas horizontales que viajan como unidades de
+# trabajo independientes. Cada banda lleva delante (fila inicial, alto del frame
+# completo) para que el nodo aplique su parte de la viñeta y de las barras
+CABECERA_BANDA = struct.Struct('>HH')
+
+def num_bandas(width, height, pixeles_banda):
+    # Como mucho una banda por cada par de filas (YUV 4:2:0 necesita alturas pares)
+    bandas = math.ceil(width * height / max(pixeles_banda, 1))
+    return max(1, min(bandas, height // 2))
+
+def limites_bandas(height, bandas):
+    # Bandas de alto par; la última se queda con las filas sobrantes
+    paso = (height // bandas) & ~1
+    return [(i * paso, height if i == bandas - 1 else (i + 1) * paso) for i in range(bandas)]
+
+def dividir_frame(payload, bandas):
+    # `payload` es [4 bytes id][frame con cabecera de codec]. Devuelve un payload por
+    # banda con id frame_id * bandas + banda. BGR y YUV 4:2:0 se recortan sin decodificar;
+    # el resto se decodifica una vez y cada banda se recodifica con el mismo codec y calidad
+    frame_id = int.from_bytes(payload[:4], byteorder='big')
+    datos = memoryview(payload)[4:]
+    codec, calidad, _, height = leer_cabecera(datos)
+    if bandas > height // 2:
+        raise ValueError(f"Frame de {height} filas demasiado bajo para {bandas} bandas")
+    frame = None if codec in CODECS_SIN_COMPRESION else decodificar_frame(datos)[0]
+    
+    unidades = []
+    for banda, (fila, fin) in enumerate(limites_bandas(height, bandas)):
+        cabecera = (frame_id * bandas + banda).to_bytes(4, byteorder='big') + CABECERA_BANDA.pack(fila, height)
+        if frame is None:
+            cuerpo = partes_recorte(datos, fila, fin)
+        else:
+            cuerpo = [codificar_frame(frame[fila:fin], codec, calidad)]
+        unidades.append(np.concatenate([np.frombuffer(cabecera, np.uint8)] + cuerpo))
+    return unidades
+
+def leer_banda(datos):
+    # Devuelve (fila inicial, alto del frame completo, frame codificado de la banda)
+    if len(datos) < CABECERA_BANDA.size:
+        raise ValueError(f"Banda sin cabecera ({len(datos)} bytes)")
+    fila, alto_total = CABECERA_BANDA.unpack_from(datos, 0)
+    return fila, alto_total, memoryview(datos)[CABECERA_BANDA.size:]
\ No newline at end of file
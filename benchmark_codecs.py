@@ -0,0 +1,82 @@
+import sys
+import time
+import cv2
+import numpy as np
+from codificacion import CODECS, NOMBRES_CODEC, codec_por_nombre, codificar_frame, decodificar_frame
+
+CALIDAD = 90
+MAX_FRAMES = 60
+VELOCIDADES_RED_GBPS = (1, 10, 25)
+
+# Compara, para cada codec, la CPU de codificar y decodificar un frame con los bytes
+# que ocupa en la red. Cada frame hace dos saltos (cliente → nodo → servidor) y en
+# cada uno se paga una codificación y una decodificación
+
+def leer_frames(video_path, max_frames):
+    cap = cv2.VideoCapture(video_path)
+    frames = []
+    while len(frames) < max_frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frames.append(frame)
+    cap.release()
+    return frames
+
+def psnr(original, reconstruido):
+    mse = np.mean((original.astype(np.float64) - reconstruido.astype(np.float64)) ** 2)
+    return float('inf') if mse == 0 else 10 * np.log10(255.0 ** 2 / mse)
+
+def medir(frames, codec, calidad):
+    inicio = time.process_time()
+    codificados = [codificar_frame(frame, codec, calidad) for frame in frames]
+    cpu_codificar = time.process_time() - inicio
+    
+    inicio = time.process_time()
+    decodificados = [decodificar_frame(datos)[0] for datos in codificados]
+    cpu_decodificar = time.process_time() - inicio
+    
+    n = len(frames)
+    return {
+        'bytes': sum(datos.nbytes for datos in codificados) / n,
+        'codificar_ms': cpu_codificar / n * 1000,
+        'decodificar_ms': cpu_decodificar / n * 1000,
+        'psnr': np.mean([psnr(a, b) for a, b in zip(frames, decodificados)]),
+    }
+
+def main():
+    if len(sys.argv) < 2:
+        print("Uso: python benchmark_codecs.py <video> [calidad]")
+        return
+    
+    calidad = int(sys.argv[2]) if len(sys.argv) > 2 else CALIDAD
+    frames = leer_frames(sys.argv[1], MAX_FRAMES)
+    if not frames:
+        print("[ERROR] No se pudieron leer frames del video")
+        return
+    
+    # CPU de un solo núcleo, como la de un worker
+    cv2.setNumThreads(1)
+    height, width = frames[0].shape[:2]
+    print(f"{len(frames)} frames {width}x{height}, calidad {calidad}")
+    
+    cabecera = f"{'codec':<8} {'KB/frame':>9} {'cod ms':>7} {'dec ms':>7} {'CPU/salto':>9} {'PSNR dB':>8}"
+    for gbps in VELOCIDADES_RED_GBPS:
+        cabecera += f" {f'red {gbps}G':>9}"
+    print(cabecera)
+    
+    for nombre in CODECS:
+        codec = codec_por_nombre(nombre, width, height)
+        if NOMBRES_CODEC[codec] != nombre:
+            continue
+        r = medir(frames, codec, calidad)
+        
+        linea = f"{nombre:<8} {r['bytes'] / 1024:>9.1f} {r['codificar_ms']:>7.2f} {r['decodificar_ms']:>7.2f}"
+        linea += f" {r['codificar_ms'] + r['decodificar_ms']:>9.2f} {r['psnr']:>8.1f}"
+        for gbps in VELOCIDADES_RED_GBPS:
+            linea += f" {r['bytes'] * 8 / (gbps * 1e9) * 1000:>9.2f}"
+        print(linea)
+    print("Tiempos en ms por frame; 'red' es el tiempo de transmisión por salto")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,76 @@
+import sys
+import time
+import cv2
+import numpy as np
+from Nodo_Procesamiento import BAR_HEIGHT_RATIO, VIGNETTE_SIGMA, CineFilter
+
+RESOLUCIONES = ((854, 480), (1280, 720), (1920, 1080), (3840, 2160))
+REPETICIONES = 20
+
+# Compara, por resolución, el tiempo por frame de CineFilter con el del filtro original
+# en coma flotante (ganancias teal-orange, clip, curva S y viñeta en float64) y la
+# diferencia máxima entre ambas salidas, que debe quedarse en ±1
+
+class FiltroOriginal:
+    # Implementación original, antes de la LUT combinada y la viñeta en punto fijo
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        
+        kernel_x = cv2.getGaussianKernel(width, width * VIGNETTE_SIGMA)
+        kernel_y = cv2.getGaussianKernel(height, height * VIGNETTE_SIGMA)
+        kernel = kernel_y * kernel_x.T
+        self.vignette_mask = kernel / kernel.max()
+        
+        self.lut_contrast = np.zeros((256, 1), dtype='uint8')
+        for i in range(256):
+            self.lut_contrast[i][0] = int(255.0 / (1 + np.exp(-((i - 128) / 32.0))))
+    
+    def apply_cinematic_style(self, frame):
+        b, g, r = cv2.split(frame)
+        merged = cv2.merge([b.astype(float) * 1.15, g.astype(float) * 0.95, r.astype(float) * 1.15])
+        frame_colored = np.clip(merged, 0, 255).astype(np.uint8)
+        
+        frame_float = cv2.LUT(frame_colored, self.lut_contrast).astype(float)
+        frame_float[:, :, 0] *= self.vignette_mask
+        frame_float[:, :, 1] *= self.vignette_mask
+        frame_float[:, :, 2] *= self.vignette_mask
+        frame_final = frame_float.astype(np.uint8)
+        
+        bar_height = int(self.height * BAR_HEIGHT_RATIO)
+        cv2.rectangle(frame_final, (0, 0), (self.width, bar_height), (0, 0, 0), -1)
+        cv2.rectangle(frame_final, (0, self.height - bar_height), (self.width, self.height), (0, 0, 0), -1)
+        return frame_final
+
+def frame_prueba(width, height, semilla=0):
+    # Ruido sobre un degradado: recorre todo el rango de valores en cada canal
+    rng = np.random.default_rng(semilla)
+    degradado = np.linspace(0, 255, width, dtype=np.float64)[None, :, None]
+    ruido = rng.normal(0, 40, (height, width, 3))
+    return np.clip(degradado + ruido, 0, 255).astype(np.uint8)
+
+def medir(aplicar, frame, repeticiones):
+    aplicar(frame)
+    inicio = time.perf_counter()
+    for _ in range(repeticiones):
+        aplicar(frame)
+    return (time.perf_counter() - inicio) / repeticiones * 1000
+
+def main():
+    repeticiones = int(sys.argv[1]) if len(sys.argv) > 1 else REPETICIONES
+    # CPU de un solo núcleo, como la de un worker
+    cv2.setNumThreads(1)
+    print(f"{'resolución':<11} {'original ms':>11} {'actual ms':>9} {'mejora':>7} {'dif máx':>8} {'% dif':>6}")
+    for width, height in RESOLUCIONES:
+        frame = frame_prueba(width, height)
+        original = FiltroOriginal(width, height)
+        actual = CineFilter(width, height)
+        
+        diferencia = np.abs(original.apply_cinematic_style(frame).astype(np.int16) - actual.apply_cinematic_style(frame))
+        ms_original = medir(original.apply_cinematic_style, frame, max(1, repeticiones // 4))
+        ms_actual = medir(actual.apply_cinematic_style, frame, repeticiones)
+        print(f"{f'{width}x{height}':<11} {ms_original:>11.2f} {ms_actual:>9.2f} {ms_original / ms_actual:>6.1f}x {diferencia.max():>8} {np.mean(diferencia > 0) * 100:>6.1f}")
+    print("Tiempos en ms por frame; 'dif máx' es la mayor diferencia por canal con el filtro original")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
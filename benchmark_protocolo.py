@@ -0,0 +1,85 @@
+import sys
+import time
+import socket
+import threading
+from protocolo import enviar_paquete, recibir_paquete
+
+TAMANOS_MB = (0.1, 1, 10)
+MB_POR_PRUEBA = 20
+MAX_MB_ORIGINAL = 10
+
+# Compara, sobre un socketpair local, el envío y la recepción de paquetes con prefijo
+# de longitud de protocolo.py con las funciones originales que se copiaban en los tres
+# programas (recepción concatenando bloques de 4 KB y envío concatenando cabecera y cuerpo)
+
+def recibir_bytes_exactos_original(sock, num_bytes):
+    data = b""
+    while len(data) < num_bytes:
+        packet = sock.recv(num_bytes - len(data))
+        if not packet:
+            return None
+        data += packet
+    return data
+
+def recibir_paquete_original(sock):
+    size_data = recibir_bytes_exactos_original(sock, 4)
+    if not size_data:
+        return None
+    
+    total_size = int.from_bytes(size_data, byteorder='big')
+    
+    payload = b""
+    while len(payload) < total_size:
+        packet = sock.recv(min(4096, total_size - len(payload)))
+        if not packet:
+            return None
+        payload += packet
+    
+    return payload
+
+def enviar_paquete_original(sock, frame_id, cuerpo):
+    payload = frame_id.to_bytes(4, byteorder='big') + cuerpo
+    sock.sendall(len(payload).to_bytes(4, byteorder='big') + payload)
+
+def enviar_paquete_actual(sock, frame_id, cuerpo):
+    enviar_paquete(sock, frame_id.to_bytes(4, byteorder='big'), cuerpo)
+
+def medir(enviar, recibir, tam, repeticiones):
+    emisor, receptor = socket.socketpair()
+    cuerpo = bytes(tam)
+    
+    def bucle_envio():
+        for frame_id in range(repeticiones):
+            enviar(emisor, frame_id, cuerpo)
+    
+    hilo = threading.Thread(target=bucle_envio, daemon=True)
+    inicio = time.perf_counter()
+    hilo.start()
+    try:
+        for _ in range(repeticiones):
+            payload = recibir(receptor)
+            if payload is None or len(payload) != tam + 4:
+                raise RuntimeError("paquete incompleto")
+        hilo.join()
+        return (time.perf_counter() - inicio) / repeticiones * 1000
+    finally:
+        emisor.close()
+        receptor.close()
+
+def main():
+    tamanos = [float(arg) for arg in sys.argv[1:]] or TAMANOS_MB
+    print(f"{'MB':>6} {'original ms':>12} {'actual ms':>10} {'mejora':>8}")
+    for tam_mb in tamanos:
+        tam = int(tam_mb * 1024 * 1024)
+        repeticiones = max(1, int(MB_POR_PRUEBA / tam_mb))
+        actual = medir(enviar_paquete_actual, recibir_paquete, tam, repeticiones)
+        if tam_mb <= MAX_MB_ORIGINAL:
+            # La recepción original es cuadrática: con paquetes grandes basta una repetición
+            original = medir(enviar_paquete_original, recibir_paquete_original, tam, max(1, repeticiones // 20))
+            print(f"{tam_mb:>6g} {original:>12.2f} {actual:>10.2f} {original / actual:>7.1f}x")
+        else:
+            print(f"{tam_mb:>6g} {'-':>12} {actual:>10.2f} {'-':>8}")
+    print(f"Tiempos en ms por paquete (envío y recepción); la versión original solo se mide hasta {MAX_MB_ORIGINAL} MB")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
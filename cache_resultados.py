@@ -0,0 +1,122 @@
+import collections
+import hashlib
+import json
+import os
+
+# Cachés del servidor direccionadas por contenido. Un resultado (frame, banda o segmento
+# procesado) se indexa por el hash de los bytes codificados que se enviarían al nodo y por
+# la huella del filtro del nodo que lo produjo; un video completo, por el hash del archivo
+# original, los parámetros de la sesión, la huella del filtro y la clave del cliente. Los
+# nodos sin huella (versiones antiguas) no anuncian sus parámetros y sus resultados no se guardan
+
+def hash_contenido(datos):
+    return hashlib.blake2b(datos, digest_size=16).digest()
+
+class CacheResultados:
+    # LRU en memoria limitada en bytes
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entradas = collections.OrderedDict()
+        self.bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.bytes_ahorrados = 0
+    
+    def activa(self):
+        return self.max_bytes > 0
+    
+    def buscar(self, digest, huellas, tam_entrada):
+        # Devuelve (resultado, huella) o (None, None). Vale el resultado de cualquier
+        # filtro de los nodos conectados: es el que devolvería uno de ellos
+        for huella in huellas:
+            clave = (huella, digest)
+            resultado = self.entradas.get(clave)
+            if resultado is not None:
+                self.entradas.move_to_end(clave)
+                self.aciertos += 1
+                # Tráfico con los nodos evitado: la unidad de ida y el resultado de vuelta
+                self.bytes_ahorrados += tam_entrada + len(resultado)
+                return resultado, huella
+        self.fallos += 1
+        return None, None
+    
+    def guardar(self, digest, huella, resultado):
+        tam = len(resultado)
+        if huella is None or tam > self.max_bytes:
+            return
+        clave = (huella, digest)
+        if clave in self.entradas:
+            self.entradas.move_to_end(clave)
+            return
+        # Copia propia: el resultado suele ser una vista sobre el lote completo recibido del nodo
+        self.entradas[clave] = bytes(resultado)
+        self.bytes += tam
+        while self.bytes > self.max_bytes:
+            _, expulsado = self.entradas.popitem(last=False)
+            self.bytes -= len(expulsado)
+    
+    def tasa_aciertos(self):
+        consultas = self.aciertos + self.fallos
+        return self.aciertos / consultas if consultas else 0.0
+
+class CacheVideos:
+    # Videos ya procesados, un archivo por clave en `directorio`. El índice se reconstruye
+    # al arrancar a partir de los archivos existentes, del más antiguo al más reciente.
+    # El servidor no puede comprobar que el hash del video corresponde a lo que se subió:
+    # cada entrada queda en el ámbito del cliente que la subió (su clave), así un cliente
+    # no puede servir su resultado a otros ni obtener el de otro conociendo solo el hash
+    def __init__(self, directorio, max_bytes):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.videos = collections.OrderedDict()
+        self.bytes = 0
+        self.aciertos = 0
+        self.fallos = 0
+        self.bytes_ahorrados = 0
+        
+        os.makedirs(directorio, exist_ok=True)
+        archivos = [entrada for entrada in os.scandir(directorio) if entrada.is_file() and entrada.name.endswith('.mp4')]
+        for entrada in sorted(archivos, key=lambda entrada: entrada.stat().st_mtime):
+            tam = entrada.stat().st_size
+            self.videos[entrada.name[:-4]] = tam
+            self.bytes += tam
+        self._recortar()
+    
+    def _clave(self, ambito, hash_video, parametros, huella):
+        texto = json.dumps([ambito, hash_video, parametros, huella], sort_keys=True)
+        return hashlib.blake2b(texto.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f"{clave}.mp4")
+    
+    def _recortar(self):
+        while self.bytes > self.max_bytes and self.videos:
+            clave, tam = self.videos.popitem(last=False)
+            self.bytes -= tam
+            try:
+                os.unlink(self._ruta(clave))
+            except FileNotFoundError:
+                pass
+    
+    def buscar(self, ambito, hash_video, parametros, huellas):
+        for huella in huellas:
+            clave = self._clave(ambito, hash_video, parametros, huella)
+            if clave in self.videos and os.path.exists(self._ruta(clave)):
+                self.videos.move_to_end(clave)
+                self.aciertos += 1
+                self.bytes_ahorrados += self.videos[clave]
+                return self._ruta(clave)
+        self.fallos += 1
+        return None
+    
+    def guardar(self, ambito, hash_video, parametros, huella, ruta_video):
+        # Mueve el video al directorio de la caché (mismo sistema de archivos que los temporales)
+        tam = os.path.getsize(ruta_video)
+        if huella is None or tam > self.max_bytes:
+            return False
+        clave = self._clave(ambito, hash_video, parametros, huella)
+        os.replace(ruta_video, self._ruta(clave))
+        self.bytes += tam - self.videos.pop(clave, 0)
+        self.videos[clave] = tam
+        self._recortar()
+        return True
\ No newline at end of file
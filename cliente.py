@@ -7,11 +7,31 @@ import os
 import time
 import json
 import atexit
+import hashlib
+import secrets
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from protocolo import configurar_log_error, enviar_paquete, recibir_archivo, recibir_paquete
+from segmentos import EscritorSegmento
+from codificacion import NOMBRES_CODEC, codec_por_nombre, codificar_frame
 
 SERVER_HOST = 'localhost'
 SERVER_PORT = 8080
-JPEG_QUALITY = 90
+CODEC_FRAMES = 'jpeg'
+CALIDAD_FRAMES = 90
+MODO_SEGMENTOS = False
+FRAMES_SEGMENTO = 30
+NUM_CODIFICADORES = os.cpu_count() or 1
+MEMORIA_SUBIDA_MB = 256
+DETECTAR_REPETIDOS = True
+UMBRAL_REPETIDOS = 2
+TAM_MINIATURA_REPETIDOS = (64, 36)
+INTERVALO_PROGRESO_UI = 0.25
+PREFIJO_HILOS_SUBIDA = 'subida'
 MAX_FILE_SIZE_MB = 500
+USAR_CACHE_SERVIDOR = True
+ARCHIVO_CLAVE_CACHE = os.path.join(os.path.expanduser('~'), '.cine_clave_cache')
 
 temp_files = []
 
@@ -25,43 +45,16 @@ def cleanup_temp_files():
 
 atexit.register(cleanup_temp_files)
 
-def enviar_paquete(sock, payload):
-    try:
-        size_bytes = len(payload).to_bytes(4, byteorder='big')
-        sock.sendall(size_bytes + payload)
-        return True
-    except Exception as e:
-        st.error(f"Error enviando paquete: {e}")
-        return False
+def reportar_error(mensaje):
+    # Solo el hilo del script de Streamlit puede escribir en la página. Los hilos de la
+    # subida no tienen su contexto: imprimen el error, y `_fallar` lo guarda para que
+    # el hilo del script lo muestre al terminar
+    if threading.current_thread().name.startswith(PREFIJO_HILOS_SUBIDA):
+        print(f"[ERROR] {mensaje}")
+    else:
+        st.error(mensaje)
 
-def recibir_bytes_exactos(sock, num_bytes):
-    data = b""
-    while len(data) < num_bytes:
-        try:
-            packet = sock.recv(num_bytes - len(data))
-            if not packet:
-                return None
-            data += packet
-        except Exception as e:
-            st.error(f"Error recibiendo datos: {e}")
-            return None
-    return data
-
-def recibir_paquete(sock):
-    size_data = recibir_bytes_exactos(sock, 4)
-    if not size_data:
-        return None
-    
-    total_size = int.from_bytes(size_data, byteorder='big')
-    
-    payload = b""
-    while len(payload) < total_size:
-        packet = sock.recv(min(4096, total_size - len(payload)))
-        if not packet:
-            return None
-        payload += packet
-    
-    return payload
+configurar_log_error(reportar_error)
 
 def validar_video(video_path):
     try:
@@ -83,6 +76,219 @@ def validar_video(video_path):
     except Exception as e:
         return False, f"Error validando video: {e}"
 
+def error_servidor(sock):
+    # Si el servidor rechazó la sesión durante la subida, su mensaje de error suele haber
+    # llegado antes de que se cortara la conexión
+    try:
+        sock.settimeout(1.0)
+        payload = recibir_paquete(sock)
+        respuesta = json.loads(payload.decode('utf-8')) if payload else {}
+    except (OSError, ValueError):
+        return None
+    if respuesta.get('status') != 'error':
+        return None
+    return f"Error del servidor: {respuesta.get('message', 'Desconocido')}"
+
+def hash_archivo(video_path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(video_path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            h.update(bloque)
+    return h.hexdigest()
+
+def clave_cache():
+    # Clave aleatoria de esta instalación del cliente. El servidor solo devuelve de su caché
+    # de videos los que procesó para la misma clave: conocer el hash de un video no basta
+    # para obtener el resultado de otro usuario ni para sustituirlo
+    try:
+        with open(ARCHIVO_CLAVE_CACHE) as f:
+            clave = f.read().strip()
+        if len(clave) >= 32:
+            return clave
+    except OSError:
+        pass
+    
+    clave = secrets.token_hex(16)
+    try:
+        fd = os.open(ARCHIVO_CLAVE_CACHE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            f.write(clave)
+    except OSError:
+        # Sin poder guardarla cada subida usa una clave nueva y la caché de videos no se reutiliza
+        pass
+    return clave
+
+def codificar_segmento(frames, fps, width, height):
+    escritor = EscritorSegmento(fps, width, height)
+    try:
+        for frame in frames:
+            escritor.escribir(frame)
+        return escritor.terminar()
+    except Exception:
+        escritor.descartar()
+        raise
+
+class DetectorRepetidos:
+    # Cada frame se reduce a una miniatura y se compara con la del primero de la racha
+    # actual (el último que se subió). Es repetido si ninguna celda de la miniatura cambia
+    # más de `umbral` niveles: un cambio pequeño pero localizado (un cursor) basta para subirlo
+    def __init__(self, umbral):
+        self.umbral = umbral
+        self.referencia = None
+    
+    def repetido(self, frame):
+        miniatura = cv2.resize(frame, TAM_MINIATURA_REPETIDOS, interpolation=cv2.INTER_AREA).astype(np.int16)
+        if self.referencia is not None and np.abs(miniatura - self.referencia).max() <= self.umbral:
+            return True
+        self.referencia = miniatura
+        return False
+
+class SubidaVideo:
+    # Subida en tubería: un hilo decodifica el video, un pool de NUM_CODIFICADORES codifica
+    # (cada frame con el codec negociado o MP4 por segmento) y otro hilo envía los paquetes en orden.
+    # Los frames decodificados en memoria se limitan a MEMORIA_SUBIDA_MB y la cola de
+    # envío está acotada, así que si la red no da abasto se frena la decodificación.
+    # Con un detector, los frames repetidos no se codifican: se envía solo su id
+    def __init__(self, sock, cap, total_frames, fps, width, height, codec=None, detector=None):
+        self.sock = sock
+        self.cap = cap
+        self.total_frames = total_frames
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.codec = codec
+        self.detector = detector
+        self.executor = ThreadPoolExecutor(max_workers=NUM_CODIFICADORES, thread_name_prefix=f"{PREFIJO_HILOS_SUBIDA}-codificacion")
+        
+        tam_frame = max(width * height * 3, 1)
+        minimo = FRAMES_SEGMENTO if MODO_SEGMENTOS else 1
+        self.slots = threading.BoundedSemaphore(max(minimo, MEMORIA_SUBIDA_MB * 1024 * 1024 // tam_frame))
+        self.pendientes = queue.Queue(maxsize=NUM_CODIFICADORES * 2)
+        
+        self.cancelada = threading.Event()
+        self.error = None
+        self.frames_enviados = 0
+        self.frames_repetidos = 0
+        self.bytes_enviados = 0
+        self.hilo_lectura = threading.Thread(target=self._bucle_lectura, name=f"{PREFIJO_HILOS_SUBIDA}-lectura", daemon=True)
+        self.hilo_envio = threading.Thread(target=self._bucle_envio, name=f"{PREFIJO_HILOS_SUBIDA}-envio", daemon=True)
+    
+    def iniciar(self):
+        self.hilo_lectura.start()
+        self.hilo_envio.start()
+    
+    def esperar(self, timeout):
+        self.hilo_envio.join(timeout)
+        return not self.hilo_envio.is_alive()
+    
+    def cerrar(self):
+        self.cancelada.set()
+        self.hilo_lectura.join()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+    
+    def _fallar(self, mensaje):
+        if self.error is None:
+            self.error = mensaje
+        self.cancelada.set()
+    
+    def _reservar(self, n=1):
+        for _ in range(n):
+            while not self.slots.acquire(timeout=0.1):
+                if self.cancelada.is_set():
+                    return False
+        return True
+    
+    def _encolar(self, unidad_id, num_frames, futuro):
+        while not self.cancelada.is_set():
+            try:
+                self.pendientes.put((unidad_id, num_frames, futuro), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _codificar_segmento(self, segmento_id, frames):
+        futuro = self.executor.submit(codificar_segmento, frames, self.fps, self.width, self.height)
+        futuro.add_done_callback(lambda _: self.slots.release(len(frames)))
+        return self._encolar(segmento_id, len(frames), futuro)
+    
+    def _bucle_lectura(self):
+        try:
+            # En modo segmentos los frames se recomprimen en MP4 cortos de FRAMES_SEGMENTO
+            # frames; cada segmento se codifica en un worker distinto
+            frames = []
+            segmento_id = 0
+            for frame_id in range(self.total_frames):
+                if not self._reservar():
+                    return
+                ret, frame = self.cap.read()
+                if not ret:
+                    self.slots.release()
+                    break
+                
+                if MODO_SEGMENTOS:
+                    frames.append(frame)
+                    if len(frames) == FRAMES_SEGMENTO:
+                        if not self._codificar_segmento(segmento_id, frames):
+                            return
+                        frames = []
+                        segmento_id += 1
+                elif self.detector is not None and self.detector.repetido(frame):
+                    self.slots.release()
+                    if not self._encolar(frame_id, 1, None):
+                        return
+                else:
+                    futuro = self.executor.submit(codificar_frame, frame, self.codec, CALIDAD_FRAMES)
+                    futuro.add_done_callback(lambda _: self.slots.release())
+                    if not self._encolar(frame_id, 1, futuro):
+                        return
+            
+            if frames:
+                self._codificar_segmento(segmento_id, frames)
+        except Exception as e:
+            self._fallar(f"Error leyendo el video: {e}")
+        finally:
+            while self.hilo_envio.is_alive():
+                try:
+                    self.pendientes.put(None, timeout=0.1)
+                    break
+                except queue.Full:
+                    continue
+    
+    def _bucle_envio(self):
+        unidad = "segmento" if MODO_SEGMENTOS else "frame"
+        while True:
+            item = self.pendientes.get()
+            if item is None or self.cancelada.is_set():
+                return
+            
+            unidad_id, num_frames, futuro = item
+            if futuro is None:
+                # Frame repetido: el servidor replica el resultado del anterior
+                if not enviar_paquete(self.sock, unidad_id.to_bytes(4, byteorder='big')):
+                    self._fallar(f"Error enviando {unidad} {unidad_id}")
+                    return
+                self.frames_enviados += num_frames
+                self.frames_repetidos += num_frames
+                continue
+            
+            try:
+                datos = futuro.result()
+            except Exception as e:
+                self._fallar(f"Error codificando {unidad} {unidad_id}: {e}")
+                return
+            
+            if not enviar_paquete(self.sock, unidad_id.to_bytes(4, byteorder='big'), datos):
+                self._fallar(f"Error enviando {unidad} {unidad_id}")
+                return
+            self.frames_enviados += num_frames
+            self.bytes_enviados += len(datos)
+    
+    def bytes_evitados(self):
+        # Estimación: lo que habrían ocupado los repetidos con el tamaño medio de los subidos
+        subidos = self.frames_enviados - self.frames_repetidos
+        return self.frames_repetidos * self.bytes_enviados / subidos if subidos else 0
+
 def procesar_video(video_path, progress_container):
     sock = None
     
@@ -92,6 +298,11 @@ def procesar_video(video_path, progress_container):
             progress_bar = st.progress(0)
             stats_text = st.empty()
         
+        hash_video = None
+        if USAR_CACHE_SERVIDOR:
+            status_text.info("Calculando huella del video...")
+            hash_video = hash_archivo(video_path)
+        
         status_text.info("Conectando al servidor...")
         sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         sock.connect((SERVER_HOST, SERVER_PORT))
@@ -110,68 +321,131 @@ def procesar_video(video_path, progress_container):
             'total_frames': total_frames,
             'fps': fps,
             'width': width,
-            'height': height
+            'height': height,
+            'progreso': True
         }
+        codec = None
+        detector = None
+        if MODO_SEGMENTOS:
+            metadata['modo'] = 'segmentos'
+            metadata['frames_segmento'] = FRAMES_SEGMENTO
+        else:
+            codec = codec_por_nombre(CODEC_FRAMES, width, height)
+            metadata['codec'] = NOMBRES_CODEC[codec]
+            metadata['calidad'] = CALIDAD_FRAMES
+            # En modo segmentos el codec de video ya aprovecha los frames repetidos
+            if DETECTAR_REPETIDOS:
+                detector = DetectorRepetidos(UMBRAL_REPETIDOS)
+                metadata['repetidos'] = UMBRAL_REPETIDOS
+        if hash_video is not None:
+            metadata['hash_video'] = hash_video
+            metadata['clave_cache'] = clave_cache()
         metadata_json = json.dumps(metadata).encode('utf-8')
         
         if not enviar_paquete(sock, metadata_json):
             st.error("Error enviando metadata")
             return None
         
-        status_text.info(f"Enviando {total_frames} frames al cluster...")
+        # Con el hash, el servidor contesta antes de la subida: 'subir' o el video ya procesado
+        response = None
+        if hash_video is not None:
+            response_payload = recibir_paquete(sock)
+            if not response_payload:
+                st.error("Error recibiendo respuesta del servidor")
+                return None
+            response = json.loads(response_payload.decode('utf-8'))
+            if response['status'] == 'subir':
+                response = None
+            else:
+                cap.release()
         
-        start_time = time.time()
-        for frame_id in range(total_frames):
-            ret, frame = cap.read()
-            if not ret:
-                break
+        resumen_repetidos = ""
+        if response is None:
+            status_text.info(f"Enviando {total_frames} frames al cluster...")
+            
+            subida = SubidaVideo(sock, cap, total_frames, fps, width, height, codec, detector)
+            start_time = time.time()
             
-            _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
-            img_bytes = buffer.tobytes()
+            def mostrar_subida():
+                enviados = subida.frames_enviados
+                progress_bar.progress(min(enviados / total_frames, 1.0) if total_frames else 1.0)
+                
+                elapsed = time.time() - start_time
+                speed = enviados / elapsed if elapsed > 0 else 0
+                repetidos = f" | Repetidos sin subir: {subida.frames_repetidos} (~{subida.bytes_evitados() / (1024*1024):.1f} MB)" if subida.frames_repetidos else ""
+                stats_text.text(f"Progreso: {enviados}/{total_frames} frames | Velocidad: {speed:.1f} fps{repetidos}")
             
-            id_bytes = frame_id.to_bytes(4, byteorder='big')
-            payload = id_bytes + img_bytes
+            # Los widgets solo se actualizan desde este hilo, cada INTERVALO_PROGRESO_UI segundos
+            subida.iniciar()
+            try:
+                while not subida.esperar(INTERVALO_PROGRESO_UI):
+                    mostrar_subida()
+            finally:
+                subida.cerrar()
+                cap.release()
+            mostrar_subida()
             
-            if not enviar_paquete(sock, payload):
-                st.error(f"Error enviando frame {frame_id}")
+            if subida.error:
+                st.error(error_servidor(sock) or subida.error)
                 return None
+            if subida.frames_repetidos:
+                resumen_repetidos = f" ({subida.frames_repetidos} de {subida.frames_enviados} frames repetidos: ~{subida.bytes_evitados() / (1024*1024):.1f} MB sin subir ni procesar en los nodos)"
             
-            if frame_id % 10 == 0 or frame_id == total_frames - 1:
-                progreso = (frame_id + 1) / total_frames
-                progress_bar.progress(progreso)
+            status_text.warning("Procesando video en el cluster...")
+            progress_bar.progress(0.0)
+            
+            while True:
+                response_payload = recibir_paquete(sock)
+                if not response_payload:
+                    st.error("Error recibiendo respuesta del servidor")
+                    return None
                 
-                elapsed = time.time() - start_time
-                speed = (frame_id + 1) / elapsed if elapsed > 0 else 0
+                response = json.loads(response_payload.decode('utf-8'))
+                if response['status'] != 'progress':
+                    break
                 
-                stats_text.text(f"Progreso: {frame_id + 1}/{total_frames} frames | Velocidad: {speed:.1f} fps")
-        
-        cap.release()
-        
-        status_text.warning("Procesando video en el cluster...")
-        progress_bar.progress(1.0)
-        
-        response_payload = recibir_paquete(sock)
-        if not response_payload:
-            st.error("Error recibiendo respuesta del servidor")
-            return None
-        
-        response = json.loads(response_payload.decode('utf-8'))
+                procesados = response['procesados']
+                total = response['total']
+                progress_bar.progress(min(procesados / total, 1.0) if total else 1.0)
+                
+                eta = response.get('eta')
+                eta_text = f"{eta:.0f} s" if eta is not None else "--"
+                stats_text.text(f"Procesados: {procesados}/{total} frames | Cluster: {response['fps']:.1f} fps | ETA: {eta_text}")
         
         if response['status'] != 'ready':
             st.error(f"Error del servidor: {response.get('message', 'Desconocido')}")
             return None
         
         video_size = response['size']
-        status_text.info(f"Descargando video procesado ({video_size / (1024*1024):.1f} MB)...")
+        origen = " (ya procesado, desde la caché del servidor)" if response.get('cache') else ""
+        status_text.info(f"Descargando video procesado{origen} ({video_size / (1024*1024):.1f} MB)...")
+        progress_bar.progress(0.0)
+        
+        output_path = tempfile.mktemp(suffix='_procesado.mp4')
+        temp_files.append(output_path)
+        
+        inicio_descarga = time.time()
+        ultima_actualizacion = 0.0
+        
+        def mostrar_descarga(recibidos, total):
+            nonlocal ultima_actualizacion
+            ahora = time.time()
+            if ahora - ultima_actualizacion < 0.25 and recibidos < total:
+                return
+            ultima_actualizacion = ahora
+            
+            progress_bar.progress(recibidos / total if total else 1.0)
+            elapsed = ahora - inicio_descarga
+            speed = recibidos / elapsed / (1024 * 1024) if elapsed > 0 else 0
+            stats_text.text(f"Descarga: {recibidos / (1024*1024):.1f}/{total / (1024*1024):.1f} MB | Velocidad: {speed:.1f} MB/s")
         
-        video_bytes = recibir_paquete(sock)
-        if not video_bytes:
+        if recibir_archivo(sock, output_path, mostrar_descarga) is None:
             st.error("Error recibiendo video procesado")
             return None
         
-        status_text.success("Procesamiento completado exitosamente")
+        status_text.success(f"Procesamiento completado exitosamente{resumen_repetidos}")
         
-        return video_bytes
+        return output_path
         
     except ConnectionRefusedError:
         st.error("No se pudo conectar al servidor. Verifica la dirección IP y puerto.")
@@ -378,15 +652,9 @@ def main():
                         st.subheader("Procesamiento")
                         progress_container = st.container()
                         
-                        video_bytes = procesar_video(video_path, progress_container)
+                        output_path = procesar_video(video_path, progress_container)
                         
-                        if video_bytes:
-                            output_path = tempfile.mktemp(suffix='_procesado.mp4')
-                            temp_files.append(output_path)
-                            
-                            with open(output_path, 'wb') as f:
-                                f.write(video_bytes)
-                            
+                        if output_path:
                             st.markdown("<div class='success-box'>Video procesado exitosamente</div>", unsafe_allow_html=True)
                             
                             st.markdown("#### Video Procesado")
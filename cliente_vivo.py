@@ -0,0 +1,246 @@
+import socket
+import sys
+import time
+import json
+import queue
+import threading
+import cv2
+import numpy as np
+from protocolo import MSG_FRAME_VIVO, enviar_paquete, recibir_paquete
+from codificacion import NOMBRES_CODEC, codec_por_nombre, codificar_frame, decodificar_frame
+
+SERVER_HOST = 'localhost'
+SERVER_PORT = 8080
+CODEC_FRAMES = 'jpeg'
+CALIDAD_FRAMES = 90
+PRESUPUESTO_MS = 250
+FPS_POR_DEFECTO = 30.0
+MAX_FRAMES_CAPTURADOS = 2
+INTERVALO_INFORME = 5.0
+
+# Transmisión en vivo sin interfaz: captura frames de una cámara (índice) o de un archivo
+# reproducido a su fps nativo, los envía según se capturan y recibe los procesados en orden.
+# La latencia de cada frame se mide desde su captura hasta que llega su resultado. Si la
+# codificación o la red no dan abasto se descartan frames en origen en vez de acumular retraso
+
+def percentiles_ms(latencias):
+    if not latencias:
+        return None, None
+    p50, p99 = np.percentile(latencias, (50, 99))
+    return p50 * 1000, p99 * 1000
+
+class TransmisionVivo:
+    def __init__(self, sock, cap, fps, codec, tiempo_real, salida=None):
+        self.sock = sock
+        self.cap = cap
+        self.fps = fps
+        self.codec = codec
+        self.tiempo_real = tiempo_real
+        self.salida = salida
+        
+        # Cola corta entre captura y envío: si se llena se tira el frame más antiguo
+        self.capturados = queue.Queue(maxsize=MAX_FRAMES_CAPTURADOS)
+        # Instante de captura de cada frame enviado y aún sin respuesta
+        self.capturas = {}
+        self.lock = threading.Lock()
+        self.latencias = []
+        self.enviados = 0
+        self.recibidos = 0
+        self.descartados_origen = 0
+        self.resumen_servidor = None
+        self.error = None
+        self.detenida = threading.Event()
+        
+        self.hilo_captura = threading.Thread(target=self._bucle_captura, daemon=True)
+        self.hilo_envio = threading.Thread(target=self._bucle_envio, daemon=True)
+        self.hilo_recepcion = threading.Thread(target=self._bucle_recepcion, daemon=True)
+    
+    def iniciar(self):
+        self.hilo_captura.start()
+        self.hilo_envio.start()
+        self.hilo_recepcion.start()
+    
+    def esperar(self, timeout):
+        self.hilo_recepcion.join(timeout)
+        return not self.hilo_recepcion.is_alive()
+    
+    def detener(self):
+        self.detenida.set()
+    
+    def _fallar(self, mensaje):
+        if self.error is None:
+            self.error = mensaje
+        self.detenida.set()
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    
+    def _poner(self, item):
+        # Solo este hilo produce: tras sacar uno siempre hay hueco
+        try:
+            self.capturados.put_nowait(item)
+        except queue.Full:
+            try:
+                self.capturados.get_nowait()
+                self.descartados_origen += 1
+            except queue.Empty:
+                pass
+            self.capturados.put_nowait(item)
+    
+    def _bucle_captura(self):
+        # Un archivo se reproduce al ritmo de su fps; una cámara ya entrega a su ritmo
+        inicio = time.monotonic()
+        leidos = 0
+        try:
+            while not self.detenida.is_set():
+                if self.tiempo_real:
+                    espera = inicio + leidos / self.fps - time.monotonic()
+                    if espera > 0:
+                        time.sleep(espera)
+                ret, frame = self.cap.read()
+                if not ret:
+                    break
+                leidos += 1
+                self._poner((time.monotonic(), frame))
+        except Exception as e:
+            self._fallar(f"Error capturando frames: {e}")
+        finally:
+            self._poner(None)
+    
+    def _bucle_envio(self):
+        frame_id = 0
+        try:
+            while True:
+                item = self.capturados.get()
+                if item is None:
+                    break
+                capturado_en, frame = item
+                datos = codificar_frame(frame, self.codec, CALIDAD_FRAMES)
+                with self.lock:
+                    self.capturas[frame_id] = capturado_en
+                if not enviar_paquete(self.sock, frame_id.to_bytes(4, byteorder='big'), datos):
+                    self._fallar(f"Error enviando frame {frame_id}")
+                    return
+                frame_id += 1
+                self.enviados += 1
+        except Exception as e:
+            self._fallar(f"Error codificando frames: {e}")
+            return
+        
+        # Fin de la transmisión: el servidor termina con los frames en curso y envía el resumen
+        try:
+            self.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+    
+    def _bucle_recepcion(self):
+        try:
+            while True:
+                payload = recibir_paquete(self.sock)
+                if payload is None:
+                    self._fallar("El servidor cerró la conexión")
+                    return
+                
+                if payload[0] != MSG_FRAME_VIVO:
+                    respuesta = json.loads(payload.decode('utf-8'))
+                    if respuesta.get('status') == 'fin':
+                        self.resumen_servidor = respuesta
+                    else:
+                        self._fallar(f"Error del servidor: {respuesta.get('message', 'Desconocido')}")
+                    return
+                
+                frame_id = int.from_bytes(payload[1:5], byteorder='big')
+                ahora = time.monotonic()
+                with self.lock:
+                    capturado_en = self.capturas.pop(frame_id, None)
+                    # Los frames llegan en orden: los anteriores sin respuesta se descartaron en el servidor
+                    while self.capturas and next(iter(self.capturas)) < frame_id:
+                        self.capturas.pop(next(iter(self.capturas)))
+                if capturado_en is not None:
+                    self.latencias.append(ahora - capturado_en)
+                self.recibidos += 1
+                
+                if self.salida is not None:
+                    frame, _, _ = decodificar_frame(memoryview(payload)[5:])
+                    self.salida.write(frame)
+        except Exception as e:
+            self._fallar(f"Error recibiendo frames: {e}")
+    
+    def informar(self):
+        p50, p99 = percentiles_ms(self.latencias)
+        latencia = f"latencia p50 {p50:.1f} ms, p99 {p99:.1f} ms" if p50 is not None else "latencia sin medir"
+        print(f"[INFO] Enviados {self.enviados}, recibidos {self.recibidos}, descartados en origen {self.descartados_origen}; {latencia}")
+
+def main():
+    if len(sys.argv) < 2:
+        print("Uso: python cliente_vivo.py <video|índice de cámara> [salida.mp4] [presupuesto_ms]")
+        return
+    
+    fuente = sys.argv[1]
+    camara = fuente.isdigit()
+    cap = cv2.VideoCapture(int(fuente) if camara else fuente)
+    if not cap.isOpened():
+        print(f"[ERROR] No se puede abrir la fuente {fuente}")
+        return
+    
+    fps = cap.get(cv2.CAP_PROP_FPS) or FPS_POR_DEFECTO
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    presupuesto = float(sys.argv[3]) if len(sys.argv) > 3 else PRESUPUESTO_MS
+    codec = codec_por_nombre(CODEC_FRAMES, width, height)
+    
+    salida = None
+    if len(sys.argv) > 2:
+        salida = cv2.VideoWriter(sys.argv[2], cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    try:
+        print(f"[INFO] Conectando a {SERVER_HOST}:{SERVER_PORT}...")
+        sock.connect((SERVER_HOST, SERVER_PORT))
+        sock.sendall(b"CLIENTE".ljust(10))
+        
+        metadata = {
+            'modo': 'vivo',
+            'fps': fps,
+            'width': width,
+            'height': height,
+            'codec': NOMBRES_CODEC[codec],
+            'calidad': CALIDAD_FRAMES,
+            'presupuesto_ms': presupuesto
+        }
+        if not enviar_paquete(sock, json.dumps(metadata).encode('utf-8')):
+            print("[ERROR] Error enviando metadata")
+            return
+        print(f"[INFO] Transmitiendo {width}x{height} a {fps:.1f} fps ({NOMBRES_CODEC[codec]}, presupuesto {presupuesto:.0f} ms)")
+        
+        transmision = TransmisionVivo(sock, cap, fps, codec, not camara, salida)
+        transmision.iniciar()
+        try:
+            while not transmision.esperar(INTERVALO_INFORME):
+                transmision.informar()
+        except KeyboardInterrupt:
+            print("[INFO] Transmisión detenida por usuario; esperando los frames en curso...")
+            transmision.detener()
+            transmision.esperar(None)
+        
+        if transmision.error:
+            print(f"[ERROR] {transmision.error}")
+        transmision.informar()
+        
+        resumen = transmision.resumen_servidor
+        if resumen is not None:
+            latencia = f", latencia en el servidor p50 {resumen['p50_ms']:.1f} ms, p99 {resumen['p99_ms']:.1f} ms" if resumen['enviados'] else ""
+            print(f"[INFO] Servidor: {resumen['enviados']} frames devueltos, {resumen['descartados']} descartados por plazo{latencia}")
+    except ConnectionRefusedError:
+        print("[ERROR] Conexión rechazada. Verifica que el servidor esté ejecutándose.")
+    except Exception as e:
+        print(f"[ERROR] Error inesperado: {e}")
+    finally:
+        sock.close()
+        cap.release()
+        if salida is not None:
+            salida.release()
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
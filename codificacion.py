@@ -0,0 +1,113 @@
+import struct
+import cv2
+import numpy as np
+
+CODEC_JPEG = 1
+CODEC_WEBP = 2
+CODEC_PNG = 3
+CODEC_BGR = 4
+CODEC_YUV420 = 5
+
+CODECS = {
+    'jpeg': CODEC_JPEG,
+    'webp': CODEC_WEBP,
+    'png': CODEC_PNG,
+    'bgr': CODEC_BGR,
+    'yuv420': CODEC_YUV420,
+}
+NOMBRES_CODEC = {codec: nombre for nombre, codec in CODECS.items()}
+CODECS_SIN_COMPRESION = (CODEC_BGR, CODEC_YUV420)
+PNG_COMPRESION = 1
+
+# Cada frame viaja con una cabecera (codec, calidad, ancho, alto) delante del cuerpo.
+# JPEG y WebP usan la calidad; PNG se comprime al nivel mínimo (sin pérdida y rápido);
+# BGR y YUV 4:2:0 van sin comprimir y se reconstruyen a partir del tamaño
+CABECERA = struct.Struct('>BBHH')
+
+def codec_por_nombre(nombre, width, height):
+    codec = CODECS.get(str(nombre).lower())
+    if codec is None:
+        raise ValueError(f"Codec desconocido: {nombre}")
+    # YUV 4:2:0 submuestrea el color 2x2: necesita dimensiones pares
+    if codec == CODEC_YUV420 and (width % 2 or height % 2):
+        return CODEC_BGR
+    return codec
+
+def tam_sin_comprimir(codec, width, height):
+    if codec == CODEC_YUV420:
+        return width * height * 3 // 2
+    return width * height * 3
+
+def codificar_frame(frame, codec, calidad):
+    # Devuelve cabecera y cuerpo en un único buffer contiguo listo para enviar
+    height, width = frame.shape[:2]
+    cabecera = np.frombuffer(CABECERA.pack(codec, calidad, width, height), np.uint8)
+    
+    if codec in CODECS_SIN_COMPRESION:
+        datos = np.empty(CABECERA.size + tam_sin_comprimir(codec, width, height), np.uint8)
+        datos[:CABECERA.size] = cabecera
+        cuerpo = datos[CABECERA.size:]
+        if codec == CODEC_BGR:
+            cuerpo.reshape(height, width, 3)[...] = frame
+        else:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2YUV_I420, dst=cuerpo.reshape(height * 3 // 2, width))
+        return datos
+    
+    if codec == CODEC_JPEG:
+        ok, cuerpo = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, calidad])
+    elif codec == CODEC_WEBP:
+        ok, cuerpo = cv2.imencode('.webp', frame, [cv2.IMWRITE_WEBP_QUALITY, calidad])
+    elif codec == CODEC_PNG:
+        ok, cuerpo = cv2.imencode('.png', frame, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESION])
+    else:
+        raise ValueError(f"Codec desconocido: {codec}")
+    if not ok:
+        raise ValueError(f"No se pudo codificar el frame en {NOMBRES_CODEC[codec]}")
+    return np.concatenate((cabecera, cuerpo.reshape(-1)))
+
+def partes_recorte(datos, fila, fin):
+    # Filas [fila, fin) de un frame BGR o YUV 4:2:0 sin decodificarlo, como lista de
+    # partes (cabecera y planos) que el llamador concatena. En YUV las filas son pares
+    codec, calidad, width, height = leer_cabecera(datos)
+    if codec not in CODECS_SIN_COMPRESION:
+        raise ValueError(f"No se pueden recortar filas de un frame {NOMBRES_CODEC.get(codec, codec)} sin decodificarlo")
+    cuerpo = np.frombuffer(memoryview(datos)[CABECERA.size:], np.uint8)
+    if cuerpo.nbytes != tam_sin_comprimir(codec, width, height):
+        raise ValueError(f"Tamaño inesperado para {NOMBRES_CODEC[codec]} {width}x{height}: {cuerpo.nbytes} bytes")
+    
+    cabecera = np.frombuffer(CABECERA.pack(codec, calidad, width, fin - fila), np.uint8)
+    if codec == CODEC_BGR:
+        return [cabecera, cuerpo.reshape(height, width * 3)[fila:fin].reshape(-1)]
+    luma = width * height
+    croma = cuerpo[luma:].reshape(2, height // 2, width // 2)
+    return [
+        cabecera,
+        cuerpo[:luma].reshape(height, width)[fila:fin].reshape(-1),
+        croma[0, fila // 2:fin // 2].reshape(-1),
+        croma[1, fila // 2:fin // 2].reshape(-1),
+    ]
+
+def leer_cabecera(datos):
+    if len(datos) < CABECERA.size:
+        raise ValueError(f"Frame sin cabecera de codec ({len(datos)} bytes)")
+    return CABECERA.unpack_from(datos, 0)
+
+def decodificar_frame(datos):
+    # Devuelve (frame, codec, calidad). En BGR el frame es una vista sobre `datos`, sin copia
+    codec, calidad, width, height = leer_cabecera(datos)
+    cuerpo = memoryview(datos)[CABECERA.size:]
+    
+    if codec in CODECS_SIN_COMPRESION:
+        if cuerpo.nbytes != tam_sin_comprimir(codec, width, height):
+            raise ValueError(f"Tamaño inesperado para {NOMBRES_CODEC[codec]} {width}x{height}: {cuerpo.nbytes} bytes")
+        plano = np.frombuffer(cuerpo, np.uint8)
+        if codec == CODEC_BGR:
+            return plano.reshape(height, width, 3), codec, calidad
+        return cv2.cvtColor(plano.reshape(height * 3 // 2, width), cv2.COLOR_YUV2BGR_I420), codec, calidad
+    
+    if codec not in NOMBRES_CODEC:
+        raise ValueError(f"Codec desconocido: {codec}")
+    frame = cv2.imdecode(np.frombuffer(cuerpo, np.uint8), cv2.IMREAD_COLOR)
+    if frame is None:
+        raise ValueError(f"No se pudo decodificar el frame {NOMBRES_CODEC[codec]}")
+    return frame, codec, calidad
\ No newline at end of file
@@ -0,0 +1,74 @@
+import secrets
+import struct
+from multiprocessing import resource_tracker, shared_memory
+
+# Anillo de slots en memoria compartida para nodos en el mismo host que el servidor.
+# Cada slot guarda [4 bytes de longitud][datos]; por el socket solo viajan el tipo
+# y el índice del slot. El servidor crea y elimina el segmento; el nodo solo se adjunta
+TAM_LONGITUD = 4
+ENTRADA_SLOT = struct.Struct('>BI')
+
+class AnilloFrames:
+    def __init__(self, shm, num_slots, tam_slot, propietario):
+        self.shm = shm
+        self.num_slots = num_slots
+        self.tam_slot = tam_slot
+        self.propietario = propietario
+        self.buffer = shm.buf
+    
+    @classmethod
+    def crear(cls, num_slots, tam_slot):
+        nombre = f"cine_{secrets.token_hex(8)}"
+        shm = shared_memory.SharedMemory(name=nombre, create=True, size=num_slots * (TAM_LONGITUD + tam_slot))
+        return cls(shm, num_slots, tam_slot, True)
+    
+    @classmethod
+    def abrir(cls, nombre, num_slots, tam_slot):
+        shm = shared_memory.SharedMemory(name=nombre)
+        # Al adjuntarse, el resource_tracker lo eliminaría al salir el nodo: el dueño es el servidor
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        if shm.size < num_slots * (TAM_LONGITUD + tam_slot):
+            shm.close()
+            raise ValueError(f"Memoria compartida {nombre} más pequeña de lo anunciado")
+        return cls(shm, num_slots, tam_slot, False)
+    
+    @property
+    def nombre(self):
+        return self.shm.name
+    
+    def cabe(self, tam):
+        return tam <= self.tam_slot
+    
+    def _inicio(self, slot):
+        if not 0 <= slot < self.num_slots:
+            raise ValueError(f"Slot fuera de rango: {slot}")
+        return slot * (TAM_LONGITUD + self.tam_slot)
+    
+    def escribir(self, slot, datos):
+        datos = memoryview(datos).cast('B')
+        if not self.cabe(datos.nbytes):
+            raise ValueError(f"{datos.nbytes} bytes no caben en un slot de {self.tam_slot}")
+        inicio = self._inicio(slot)
+        self.buffer[inicio:inicio + TAM_LONGITUD] = datos.nbytes.to_bytes(TAM_LONGITUD, byteorder='big')
+        self.buffer[inicio + TAM_LONGITUD:inicio + TAM_LONGITUD + datos.nbytes] = datos
+    
+    def leer(self, slot):
+        # Vista sin copia: solo es válida mientras nadie reutilice el slot
+        inicio = self._inicio(slot)
+        tam = int.from_bytes(self.buffer[inicio:inicio + TAM_LONGITUD], byteorder='big')
+        if not self.cabe(tam):
+            raise ValueError(f"Longitud inválida en el slot {slot}: {tam}")
+        return self.buffer[inicio + TAM_LONGITUD:inicio + TAM_LONGITUD + tam]
+    
+    def cerrar(self):
+        self.buffer = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # Quedan vistas vivas sobre el segmento: el mapeo se libera al recolectarlas
+            pass
+        if self.propietario:
+            try:
+                self.shm.unlink()
+            except FileNotFoundError:
+                pass
\ No newline at end of file
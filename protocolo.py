@@ -0,0 +1,175 @@
+import asyncio
+import os
+import struct
+
+MSG_LOTE = 2
+MSG_LATIDO = 3
+MSG_SEGMENTOS = 4
+MSG_FRAMES_CODEC = 5
+MSG_ANILLO = 6
+MSG_SLOTS = 7
+MSG_BANDAS = 8
+MSG_FRAME_VIVO = 9
+MSG_ERROR_TAREA = 10
+LATIDO = bytes([MSG_LATIDO])
+MAX_IOV = 1024
+TAM_BLOQUE_ARCHIVO = 1024 * 1024
+
+def _log_error_por_defecto(mensaje):
+    print(f"[ERROR] {mensaje}")
+
+_log_error = _log_error_por_defecto
+
+def configurar_log_error(funcion):
+    global _log_error
+    _log_error = funcion
+
+def recibir_en(conn, vista):
+    total = len(vista)
+    recibidos = 0
+    while recibidos < total:
+        n = conn.recv_into(vista[recibidos:], total - recibidos)
+        if n == 0:
+            return False
+        recibidos += n
+    return True
+
+def _recibir_tamano(conn, max_size):
+    cabecera = bytearray(4)
+    if not recibir_en(conn, memoryview(cabecera)):
+        return None
+    
+    tam = int.from_bytes(cabecera, byteorder='big')
+    if max_size is not None and tam > max_size:
+        raise ValueError(f"Payload demasiado grande: {tam} bytes")
+    return tam
+
+def recibir_paquete(conn, max_size=None):
+    try:
+        tam = _recibir_tamano(conn, max_size)
+        if tam is None:
+            return None
+        
+        payload = bytearray(tam)
+        if not recibir_en(conn, memoryview(payload)):
+            return None
+        return payload
+    except Exception as e:
+        _log_error(f"Error al recibir paquete: {e}")
+        return None
+
+def _enviar_vectorial(conn, vistas):
+    i = 0
+    while i < len(vistas):
+        enviados = conn.sendmsg(vistas[i:i + MAX_IOV])
+        while enviados > 0:
+            tam = vistas[i].nbytes
+            if enviados >= tam:
+                enviados -= tam
+                i += 1
+            else:
+                vistas[i] = vistas[i][enviados:]
+                enviados = 0
+
+def enviar_paquete(conn, *partes):
+    try:
+        vistas = [memoryview(parte).cast('B') for parte in partes]
+        vistas = [vista for vista in vistas if vista.nbytes]
+        total = sum(vista.nbytes for vista in vistas)
+        vistas.insert(0, memoryview(total.to_bytes(4, byteorder='big')))
+        
+        if hasattr(conn, 'sendmsg'):
+            _enviar_vectorial(conn, vistas)
+        else:
+            for vista in vistas:
+                conn.sendall(vista)
+        return True
+    except Exception as e:
+        _log_error(f"Error al enviar paquete: {e}")
+        return False
+
+def recibir_archivo(conn, ruta, progreso=None):
+    try:
+        tam = _recibir_tamano(conn, None)
+        if tam is None:
+            return None
+        
+        buffer = bytearray(min(TAM_BLOQUE_ARCHIVO, max(tam, 1)))
+        vista = memoryview(buffer)
+        recibidos = 0
+        with open(ruta, 'wb') as f:
+            while recibidos < tam:
+                n = conn.recv_into(vista, min(len(buffer), tam - recibidos))
+                if n == 0:
+                    return None
+                f.write(vista[:n])
+                recibidos += n
+                if progreso is not None:
+                    progreso(recibidos, tam)
+        return tam
+    except Exception as e:
+        _log_error(f"Error al recibir archivo: {e}")
+        return None
+
+async def recibir_paquete_async(reader, max_size=None):
+    try:
+        cabecera = await reader.readexactly(4)
+        tam = int.from_bytes(cabecera, byteorder='big')
+        if max_size is not None and tam > max_size:
+            raise ValueError(f"Payload demasiado grande: {tam} bytes")
+        return await reader.readexactly(tam)
+    except asyncio.IncompleteReadError:
+        return None
+    except Exception as e:
+        _log_error(f"Error al recibir paquete: {e}")
+        return None
+
+async def enviar_paquete_async(writer, *partes):
+    try:
+        vistas = [memoryview(parte).cast('B') for parte in partes]
+        total = sum(vista.nbytes for vista in vistas)
+        writer.write(total.to_bytes(4, byteorder='big'))
+        writer.writelines(vistas)
+        await writer.drain()
+        return True
+    except Exception as e:
+        _log_error(f"Error al enviar paquete: {e}")
+        return False
+
+async def enviar_archivo_async(writer, ruta):
+    try:
+        tam = os.path.getsize(ruta)
+        writer.write(tam.to_bytes(4, byteorder='big'))
+        with open(ruta, 'rb') as f:
+            await asyncio.get_running_loop().sendfile(writer.transport, f)
+        await writer.drain()
+        return True
+    except Exception as e:
+        _log_error(f"Error al enviar archivo: {e}")
+        return False
+
+def partes_lote(entradas, tipo=MSG_LOTE):
+    partes = [struct.pack('>BH', tipo, len(entradas))]
+    for id_frame, cuerpo in entradas:
+        cuerpo = memoryview(cuerpo).cast('B')
+        partes.append(struct.pack('>II', id_frame, cuerpo.nbytes))
+        partes.append(cuerpo)
+    return partes
+
+def es_latido(payload):
+    return len(payload) == 1 and payload[0] == MSG_LATIDO
+
+def desempaquetar_lote(payload):
+    vista = memoryview(payload)
+    tipo, num_frames = struct.unpack_from('>BH', vista, 0)
+    if tipo not in (MSG_LOTE, MSG_SEGMENTOS, MSG_FRAMES_CODEC, MSG_SLOTS, MSG_BANDAS, MSG_ERROR_TAREA):
+        raise ValueError(f"Tipo de mensaje desconocido: {tipo}")
+    
+    entradas = []
+    offset = 3
+    for _ in range(num_frames):
+        id_frame, tam = struct.unpack_from('>II', vista, offset)
+        offset += 8
+        entradas.append((id_frame, vista[offset:offset + tam]))
+        offset += tam
+    return entradas
\ No newline at end of file
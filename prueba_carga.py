@@ -0,0 +1,153 @@
+import sys
+import os
+import time
+import json
+import socket
+import asyncio
+import resource
+import subprocess
+import cv2
+import numpy as np
+from protocolo import enviar_paquete_async, recibir_paquete_async
+
+HOST = '127.0.0.1'
+ESCALA_NODOS = (100, 500, 2000)
+NUM_CLIENTES = 32
+FRAMES_CLIENTE = 300
+TAM_FRAME = (64, 48)
+INTERVALO_REPOSO = 5.0
+TIMEOUT_PRUEBA = 300.0
+
+# Prueba de carga del servidor central con nodos de eco (devuelven cada frame tal cual)
+# y clientes simulados en este mismo proceso. Cada directorio indicado debe contener un
+# servidor_central.py y sus módulos; para compararlo con el servidor con un hilo por
+# conexión, se extrae esa versión con `git worktree add <dir> <commit>` y se pasan ambos:
+#
+#     python prueba_carga.py . ../cine_hilos
+#
+# Por cada servidor y número de nodos mide el tiempo en conectar todos los nodos, los
+# hilos del proceso y su CPU en reposo (Linux: /proc), y los frames/s de NUM_CLIENTES
+# clientes concurrentes. El generador es un solo proceso: a muchos frames/s el límite
+# puede ser él y no el servidor
+
+def puerto_libre():
+    with socket.socket() as s:
+        s.bind((HOST, 0))
+        return s.getsockname()[1]
+
+def subir_limite_descriptores():
+    blando, duro = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if blando < duro:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (duro, duro))
+
+def iniciar_servidor(directorio, puerto, ajustes=""):
+    # Las cachés se desactivan para medir el núcleo del servidor (los frames de la prueba se repiten);
+    # `ajustes` son asignaciones extra a la configuración del módulo, p. ej. "s.PLAZO_FRAME = 5"
+    codigo = f"import servidor_central as s; s.BROKER_HOST = '{HOST}'; s.BROKER_PORT = {puerto}; s.CACHE_RESULTADOS_MB = 0; s.CACHE_VIDEOS_MB = 0; {ajustes + '; ' if ajustes else ''}s.main()"
+    proceso = subprocess.Popen([sys.executable, '-c', codigo], cwd=directorio, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    limite = time.monotonic() + 10
+    while time.monotonic() < limite:
+        try:
+            socket.create_connection((HOST, puerto), timeout=1).close()
+            return proceso
+        except OSError:
+            time.sleep(0.1)
+    proceso.kill()
+    raise RuntimeError(f"El servidor de {directorio} no arrancó")
+
+def hilos_proceso(pid):
+    with open(f"/proc/{pid}/status") as f:
+        for linea in f:
+            if linea.startswith("Threads:"):
+                return int(linea.split()[1])
+    return None
+
+def cpu_proceso(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        campos = f.read().rsplit(')', 1)[1].split()
+    return (int(campos[11]) + int(campos[12])) / os.sysconf('SC_CLK_TCK')
+
+async def nodo_eco(puerto, conectado):
+    try:
+        reader, writer = await asyncio.open_connection(HOST, puerto)
+        writer.write(b"NODO".ljust(10))
+        await writer.drain()
+    except OSError:
+        conectado.set_result(False)
+        return
+    conectado.set_result(True)
+    try:
+        while True:
+            payload = await recibir_paquete_async(reader)
+            if payload is None or not await enviar_paquete_async(writer, payload):
+                return
+    finally:
+        writer.close()
+
+async def cliente(puerto, frames, jpeg):
+    reader, writer = await asyncio.open_connection(HOST, puerto)
+    try:
+        writer.write(b"CLIENTE".ljust(10))
+        metadata = {'total_frames': frames, 'fps': 30, 'width': TAM_FRAME[0], 'height': TAM_FRAME[1]}
+        await enviar_paquete_async(writer, json.dumps(metadata).encode('utf-8'))
+        for frame_id in range(frames):
+            if not await enviar_paquete_async(writer, frame_id.to_bytes(4, byteorder='big'), jpeg):
+                return False
+        
+        respuesta = await recibir_paquete_async(reader)
+        if respuesta is None or json.loads(respuesta.decode('utf-8')).get('status') != 'ready':
+            return False
+        tam = int.from_bytes(await reader.readexactly(4), byteorder='big')
+        await reader.readexactly(tam)
+        return True
+    finally:
+        writer.close()
+
+async def medir(directorio, num_nodos, jpeg):
+    puerto = puerto_libre()
+    servidor = iniciar_servidor(directorio, puerto)
+    nodos = []
+    try:
+        loop = asyncio.get_running_loop()
+        inicio = time.monotonic()
+        conectados = [loop.create_future() for _ in range(num_nodos)]
+        nodos = [asyncio.create_task(nodo_eco(puerto, conectado)) for conectado in conectados]
+        fallidos = (await asyncio.gather(*conectados)).count(False)
+        t_conexion = time.monotonic() - inicio
+        
+        await asyncio.sleep(1.0)
+        hilos = hilos_proceso(servidor.pid)
+        cpu_inicio = cpu_proceso(servidor.pid)
+        await asyncio.sleep(INTERVALO_REPOSO)
+        cpu_reposo = cpu_proceso(servidor.pid) - cpu_inicio
+        
+        inicio = time.monotonic()
+        resultados = await asyncio.wait_for(asyncio.gather(*(cliente(puerto, FRAMES_CLIENTE, jpeg) for _ in range(NUM_CLIENTES))), TIMEOUT_PRUEBA)
+        t_frames = time.monotonic() - inicio
+        frames_s = resultados.count(True) * FRAMES_CLIENTE / t_frames
+        return t_conexion, fallidos, hilos, cpu_reposo, frames_s, resultados.count(False)
+    finally:
+        for nodo in nodos:
+            nodo.cancel()
+        await asyncio.gather(*nodos, return_exceptions=True)
+        servidor.kill()
+        servidor.wait()
+
+async def principal(directorios):
+    frame = np.random.default_rng(0).integers(0, 256, (TAM_FRAME[1], TAM_FRAME[0], 3), dtype=np.uint8)
+    jpeg = cv2.imencode('.jpg', frame)[1].tobytes()
+    
+    print(f"{NUM_CLIENTES} clientes x {FRAMES_CLIENTE} frames {TAM_FRAME[0]}x{TAM_FRAME[1]}; CPU en reposo durante {INTERVALO_REPOSO:.0f} s")
+    print(f"{'servidor':<20} {'nodos':>6} {'conexión s':>10} {'fallidas':>8} {'hilos':>6} {'CPU reposo s':>12} {'frames/s':>9} {'clientes fallidos':>17}")
+    for directorio in directorios:
+        for num_nodos in ESCALA_NODOS:
+            t_conexion, fallidos, hilos, cpu_reposo, frames_s, clientes_fallidos = await medir(directorio, num_nodos, jpeg)
+            print(f"{directorio:<20} {num_nodos:>6} {t_conexion:>10.2f} {fallidos:>8} {hilos:>6} {cpu_reposo:>12.2f} {frames_s:>9.0f} {clientes_fallidos:>17}")
+
+def main():
+    subir_limite_descriptores()
+    directorios = sys.argv[1:] or [os.path.dirname(os.path.abspath(__file__))]
+    asyncio.run(principal(directorios))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
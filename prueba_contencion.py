@@ -0,0 +1,66 @@
+import sys
+import os
+import time
+import asyncio
+import statistics
+import cv2
+import numpy as np
+from prueba_carga import TAM_FRAME, TIMEOUT_PRUEBA, puerto_libre, subir_limite_descriptores, iniciar_servidor, nodo_eco, cliente
+
+NUM_NODOS = 500
+NUM_CLIENTES = 64
+FRAMES_CLIENTE = 300
+REPETICIONES = 5
+
+# Prueba de contención del estado de sesiones: muchos nodos de eco devolviendo frames a la
+# vez que muchos clientes suben los suyos, todo contra un mismo servidor. Los nodos se
+# conectan una sola vez y se repite la ronda de clientes REPETICIONES veces; se informa
+# la mediana y el rango de frames/s. Como en prueba_carga.py, cada directorio es una
+# versión del servidor (p. ej. `git worktree add ../cine_antes <commit>`):
+#
+#     python prueba_contencion.py ../cine_antes .
+
+async def medir(directorio, jpeg):
+    puerto = puerto_libre()
+    servidor = iniciar_servidor(directorio, puerto)
+    nodos = []
+    try:
+        loop = asyncio.get_running_loop()
+        conectados = [loop.create_future() for _ in range(NUM_NODOS)]
+        nodos = [asyncio.create_task(nodo_eco(puerto, conectado)) for conectado in conectados]
+        if False in await asyncio.gather(*conectados):
+            raise RuntimeError(f"No se pudieron conectar los {NUM_NODOS} nodos a {directorio}")
+        await asyncio.sleep(1.0)
+        
+        rondas = []
+        for _ in range(REPETICIONES):
+            inicio = time.monotonic()
+            resultados = await asyncio.wait_for(asyncio.gather(*(cliente(puerto, FRAMES_CLIENTE, jpeg) for _ in range(NUM_CLIENTES))), TIMEOUT_PRUEBA)
+            if False in resultados:
+                raise RuntimeError(f"{resultados.count(False)} clientes fallaron contra {directorio}")
+            rondas.append(NUM_CLIENTES * FRAMES_CLIENTE / (time.monotonic() - inicio))
+        return rondas
+    finally:
+        for nodo in nodos:
+            nodo.cancel()
+        await asyncio.gather(*nodos, return_exceptions=True)
+        servidor.kill()
+        servidor.wait()
+
+async def principal(directorios):
+    frame = np.random.default_rng(0).integers(0, 256, (TAM_FRAME[1], TAM_FRAME[0], 3), dtype=np.uint8)
+    jpeg = cv2.imencode('.jpg', frame)[1].tobytes()
+    
+    print(f"{NUM_NODOS} nodos, {NUM_CLIENTES} clientes x {FRAMES_CLIENTE} frames {TAM_FRAME[0]}x{TAM_FRAME[1]}, {REPETICIONES} rondas")
+    print(f"{'servidor':<20} {'mediana f/s':>11} {'mín f/s':>8} {'máx f/s':>8}")
+    for directorio in directorios:
+        rondas = await medir(directorio, jpeg)
+        print(f"{directorio:<20} {statistics.median(rondas):>11.0f} {min(rondas):>8.0f} {max(rondas):>8.0f}")
+
+def main():
+    subir_limite_descriptores()
+    directorios = sys.argv[1:] or [os.path.dirname(os.path.abspath(__file__))]
+    asyncio.run(principal(directorios))
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
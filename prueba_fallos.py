@@ -0,0 +1,144 @@
+import sys
+import os
+import time
+import json
+import asyncio
+import cv2
+import numpy as np
+from protocolo import LATIDO, desempaquetar_lote, enviar_paquete_async, es_latido, partes_lote, recibir_paquete_async
+from prueba_carga import HOST, TAM_FRAME, cliente, iniciar_servidor, puerto_libre
+
+FRAMES_TRABAJO = 400
+FRAMES_ANTES_DE_COLGARSE = 20
+RETARDO_FRAME = 0.004
+PLAZO_FRAME_PRUEBA = 5.0
+TIMEOUT_PRUEBA = 120.0
+
+# Prueba de detección de fallos de nodos: un nodo falso se cuelga a propósito tras
+# FRAMES_ANTES_DE_COLGARSE frames, con frames en vuelo, mientras otro nodo sano sigue
+# trabajando. Variantes:
+#   lotes   nodo NODO_V2 con latidos que deja de leer y de contestar (proceso colgado)
+#   legacy  nodo "NODO" sin latidos que deja de contestar
+#   plazo   nodo NODO_V2 que sigue contestando latidos pero nunca devuelve los frames;
+#           solo lo detecta el plazo por frame (el servidor arranca con PLAZO_FRAME reducido)
+# Para cada una se mide cuánto tarda el servidor en cortar al nodo (en la variante plazo, en
+# reencolar sus frames: el trabajo termina) y si el trabajo de FRAMES_TRABAJO frames termina
+# completo. El reenvío especulativo se desactiva: terminaría el trabajo con los frames
+# rezagados antes de que actúe la detección de fallos, que es lo que se prueba.
+#
+#     python prueba_fallos.py [lotes|legacy|plazo ...] [--servidor <directorio>]
+
+VARIANTES = ('lotes', 'legacy', 'plazo')
+
+class NodoFalso:
+    def __init__(self, variante, corte):
+        self.variante = variante
+        self.corte = corte
+        self.frames = 0
+        self.colgado_en = None
+        self.cortado_en = None
+    
+    async def ejecutar(self, puerto):
+        reader, writer = await asyncio.open_connection(HOST, puerto)
+        try:
+            if self.variante == 'legacy':
+                writer.write(b"NODO".ljust(10))
+            else:
+                writer.write(b"NODO_V2".ljust(10))
+                capacidades = {'workers': 1, 'lotes': True, 'latidos': True}
+                await enviar_paquete_async(writer, json.dumps(capacidades).encode('utf-8'))
+            await writer.drain()
+            
+            while True:
+                payload = await recibir_paquete_async(reader)
+                if payload is None:
+                    break
+                if self.variante != 'legacy' and es_latido(payload):
+                    await enviar_paquete_async(writer, LATIDO)
+                    continue
+                if self.colgado_en is not None:
+                    continue
+                if self.frames >= self.corte:
+                    self.colgado_en = time.monotonic()
+                    if self.variante != 'plazo':
+                        # No contesta nada más, ni frames ni latidos, y descarta lo que llegue
+                        # hasta que el servidor corte la conexión
+                        while await reader.read(64 * 1024):
+                            pass
+                        self.cortado_en = time.monotonic()
+                        break
+                    continue
+                
+                await asyncio.sleep(RETARDO_FRAME)
+                if self.variante == 'legacy':
+                    self.frames += 1
+                    await enviar_paquete_async(writer, payload)
+                else:
+                    lote = desempaquetar_lote(payload)
+                    self.frames += len(lote)
+                    await enviar_paquete_async(writer, *partes_lote(lote))
+        except (ConnectionError, OSError):
+            self.cortado_en = time.monotonic()
+        finally:
+            writer.close()
+
+async def probar(directorio, variante, jpeg):
+    puerto = puerto_libre()
+    ajustes = "s.ESPECULACION_ACTIVA = False"
+    if variante == 'plazo':
+        ajustes += f"; s.PLAZO_FRAME = {PLAZO_FRAME_PRUEBA}"
+    servidor = iniciar_servidor(directorio, puerto, ajustes)
+    falso = NodoFalso(variante, FRAMES_ANTES_DE_COLGARSE)
+    sano = NodoFalso('lotes', FRAMES_TRABAJO * 10)
+    tarea_falso = asyncio.create_task(falso.ejecutar(puerto))
+    tareas = [tarea_falso, asyncio.create_task(sano.ejecutar(puerto))]
+    try:
+        await asyncio.sleep(1.0)
+        inicio = time.monotonic()
+        completo = await asyncio.wait_for(cliente(puerto, FRAMES_TRABAJO, jpeg), TIMEOUT_PRUEBA)
+        fin = time.monotonic()
+        if variante == 'plazo':
+            # El nodo sigue conectado; el fin del trabajo marca el reencolado de sus frames
+            detectado = fin
+        else:
+            await asyncio.wait([tarea_falso], timeout=TIMEOUT_PRUEBA)
+            detectado = falso.cortado_en
+        deteccion = detectado - falso.colgado_en if falso.colgado_en is not None and detectado is not None else None
+        return completo, fin - inicio, deteccion, falso.frames, sano.frames
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        servidor.kill()
+        servidor.wait()
+
+async def principal(directorio, variantes):
+    frame = np.random.default_rng(0).integers(0, 256, (TAM_FRAME[1], TAM_FRAME[0], 3), dtype=np.uint8)
+    jpeg = cv2.imencode('.jpg', frame)[1].tobytes()
+    
+    print(f"{FRAMES_TRABAJO} frames; el nodo falso se cuelga tras {FRAMES_ANTES_DE_COLGARSE}; plazo por frame en la variante plazo: {PLAZO_FRAME_PRUEBA:.0f} s")
+    print(f"{'variante':<8} {'completo':>8} {'trabajo s':>9} {'detección s':>11} {'frames falso':>12} {'frames sano':>11}")
+    fallidas = 0
+    for variante in variantes:
+        completo, duracion, deteccion, frames_falso, frames_sano = await probar(directorio, variante, jpeg)
+        texto_deteccion = f"{deteccion:.2f}" if deteccion is not None else "-"
+        print(f"{variante:<8} {'sí' if completo else 'no':>8} {duracion:>9.2f} {texto_deteccion:>11} {frames_falso:>12} {frames_sano:>11}")
+        if not completo or deteccion is None:
+            fallidas += 1
+    return fallidas
+
+def main():
+    args = sys.argv[1:]
+    directorio = os.path.dirname(os.path.abspath(__file__))
+    if '--servidor' in args:
+        i = args.index('--servidor')
+        directorio = args[i + 1]
+        del args[i:i + 2]
+    variantes = args or list(VARIANTES)
+    for variante in variantes:
+        if variante not in VARIANTES:
+            sys.exit(f"Variante desconocida: {variante} (disponibles: {', '.join(VARIANTES)})")
+    sys.exit(1 if asyncio.run(principal(directorio, variantes)) else 0)
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
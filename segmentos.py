@@ -0,0 +1,80 @@
+import contextlib
+import os
+import tempfile
+import cv2
+import numpy as np
+
+FOURCC_SEGMENTO = 'mp4v'
+
+# Un segmento es un MP4 corto e independiente (empieza en keyframe) con un rango de
+# frames consecutivos del video. OpenCV solo lee y escribe video desde archivos,
+# así que los bytes del segmento pasan por un temporal
+
+class EscritorSegmento:
+    def __init__(self, fps, width, height):
+        fd, self.ruta = tempfile.mkstemp(suffix='.mp4')
+        os.close(fd)
+        fourcc = cv2.VideoWriter_fourcc(*FOURCC_SEGMENTO)
+        self.writer = cv2.VideoWriter(self.ruta, fourcc, fps, (width, height))
+        if not self.writer.isOpened():
+            os.unlink(self.ruta)
+            raise RuntimeError("No se pudo crear VideoWriter")
+        self.frames = 0
+    
+    def escribir(self, frame):
+        self.writer.write(frame)
+        self.frames += 1
+    
+    def descartar(self):
+        self.writer.release()
+        if os.path.exists(self.ruta):
+            os.unlink(self.ruta)
+    
+    def terminar(self):
+        self.writer.release()
+        try:
+            with open(self.ruta, 'rb') as f:
+                return f.read()
+        finally:
+            os.unlink(self.ruta)
+
+@contextlib.contextmanager
+def abrir_segmento(datos, paquetes=False):
+    # Con paquetes=True la captura devuelve los paquetes comprimidos sin decodificarlos
+    fd, ruta = tempfile.mkstemp(suffix='.mp4')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(datos)
+        
+        params = [cv2.CAP_PROP_FORMAT, -1] if paquetes else []
+        cap = cv2.VideoCapture(ruta, cv2.CAP_FFMPEG, params)
+        if not cap.isOpened():
+            raise ValueError("No se pudo abrir el segmento")
+        try:
+            yield cap
+        finally:
+            cap.release()
+    finally:
+        os.unlink(ruta)
+
+def crear_writer_remux(ruta, fps, width, height):
+    fourcc = cv2.VideoWriter_fourcc(*FOURCC_SEGMENTO)
+    return cv2.VideoWriter(ruta, cv2.CAP_FFMPEG, fourcc, fps, (width, height), [cv2.VIDEOWRITER_PROP_RAW_VIDEO, 1])
+
+def copiar_paquetes(datos, writer):
+    # Remultiplexa los paquetes del segmento en `writer` sin recodificar. La cabecera
+    # del códec (VOL en MPEG-4) va en el contenedor de cada segmento y no en sus paquetes,
+    # así que se antepone al primero para que el flujo concatenado sea decodificable
+    with abrir_segmento(datos, paquetes=True) as cap:
+        ok, cabecera = cap.retrieve(None, int(cap.get(cv2.CAP_PROP_CODEC_EXTRADATA_INDEX)))
+        copiados = 0
+        while cap.grab():
+            ok, paquete = cap.retrieve()
+            if not ok:
+                break
+            if copiados == 0 and cabecera is not None and cabecera.size:
+                paquete = np.concatenate((cabecera.ravel(), paquete.ravel()))
+            writer.set(cv2.VIDEOWRITER_PROP_KEY_FLAG, cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME))
+            writer.write(paquete)
+            copiados += 1
+        return copiados
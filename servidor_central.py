@@ -1,338 +1,1572 @@
-import socket
+import asyncio
 import cv2
 import numpy as np
-import threading
-import queue
 import time
 import json
 import os
 import tempfile
+import itertools
+import collections
+import math
+import ipaddress
+from protocolo import (
+    LATIDO, MSG_ANILLO, MSG_BANDAS, MSG_ERROR_TAREA, MSG_FRAME_VIVO, MSG_FRAMES_CODEC, MSG_LOTE, MSG_SEGMENTOS, MSG_SLOTS, configurar_log_error, desempaquetar_lote, enviar_archivo_async,
+    enviar_paquete_async, es_latido, partes_lote, recibir_paquete_async
+)
+from segmentos import copiar_paquetes, crear_writer_remux
+from codificacion import CODECS, CODECS_SIN_COMPRESION, decodificar_frame, tam_sin_comprimir
+from memoria_compartida import ENTRADA_SLOT, AnilloFrames
+from bandas import dividir_frame, limites_bandas, num_bandas
+from cache_resultados import CacheResultados, CacheVideos, hash_contenido
 
 BROKER_HOST = 'localhost'
 BROKER_PORT = 8080
-MAX_PAYLOAD_SIZE = 10 * 1024 * 1024
-BUFFER_SIZE = 4096
-QUEUE_TIMEOUT = 1.0
+LISTEN_BACKLOG = 1024
+MAX_PAYLOAD_SIZE = 32 * 1024 * 1024
+VENTANA_MIN_NODO = 2
+VENTANA_MAX_NODO = 32
+VENTANA_ADAPTATIVA = True
+MUESTRAS_LATENCIA = 64
+ALFA_EWMA = 0.2
+ESPECULACION_ACTIVA = True
+INTERVALO_REZAGADOS = 0.05
+PERCENTIL_REZAGADO = 95
+FACTOR_REZAGADO = 2.0
+MIN_MUESTRAS_REZAGADO = 16
+INTERVALO_LATIDO = 1.0
+TIMEOUT_NODO = 4.0
+ESPERA_NODO_COMPATIBLE = 10.0
+PLAZO_FRAME = 30.0
+MAX_FALLOS_UNIDAD = 3
+MAX_CANDIDATOS_ESPERA = 32
+LOTE_MAX_BYTES = 512 * 1024
+LOTE_MAX_ESPERA = 0.005
+MEMORIA_COMPARTIDA = True
+TAM_SLOT_ANILLO = 8 * 1024 * 1024
+BANDAS_ACTIVAS = True
+BANDAS_COMPRIMIDAS = False
+MIN_PIXELES_BANDAS = 3840 * 2160
+PIXELES_POR_BANDA = 1920 * 1080
+PRESUPUESTO_VIVO_MS = 250
+MUESTRAS_LATENCIA_VIVO = 4096
+CACHE_RESULTADOS_MB = 512
+CACHE_VIDEOS_MB = 4096
+DIRECTORIO_CACHE_VIDEOS = os.path.join(tempfile.gettempdir(), 'cine_cache_videos')
+MIN_LONGITUD_CLAVE_CACHE = 32
+UMBRAL_HASH_EXECUTOR = 256 * 1024
+MAX_FRAMES_SESION = 256
+MAX_MEMORIA_SESION_MB = 1024
+INTERVALO_PROGRESO = 0.5
+INTERVALO_ESTADISTICAS = 10
+PRIORIDAD_ALTA = 0
+PRIORIDAD_NORMAL = 1
+PRIORIDAD_BAJA = 2
 
-cola_frames_entrada = queue.Queue()
+# Todo el estado del broker vive en el hilo del event loop; solo la
+# decodificación y escritura del video se delegan al executor.
+# sesiones_clientes solo se modifica al crear o cerrar una sesión: los frames
+# en cola y en vuelo llevan una referencia directa a su Sesion
 sesiones_clientes = {}
-lock_sesiones = threading.Lock()
 nodos_disponibles = []
-lock_nodos = threading.Lock()
 
-frames_en_proceso = {}
-lock_frames_proceso = threading.Lock()
+# Latencias recientes de todos los nodos; su percentil marca cuándo un frame en vuelo va rezagado
+latencias_frames = collections.deque(maxlen=MUESTRAS_LATENCIA * 4)
+
+contador_tareas = itertools.count(1)
 
 def log(level, message):
     timestamp = time.strftime('%Y-%m-%d %H:%M:%S')
     print(f"[{timestamp}] [{level}] {message}")
 
-def recibir_bytes_exactos(conn, num_bytes):
-    data = b""
-    while len(data) < num_bytes:
-        try:
-            packet = conn.recv(num_bytes - len(data))
-            if not packet:
-                return None
-            data += packet
-        except Exception as e:
-            log("ERROR", f"Error recibiendo bytes: {e}")
-            return None
-    return data
+configurar_log_error(lambda mensaje: log("ERROR", mensaje))
 
-def recibir_paquete(conn):
-    try:
-        size_data = recibir_bytes_exactos(conn, 4)
-        if not size_data:
-            return None
+def nueva_tarea_id():
+    return next(contador_tareas) & 0xFFFFFFFF
+
+# Resultado de una unidad de un frame repetido: el ensamblador vuelve a escribir el último frame
+REPETIDO = object()
+
+class EnsambladorVideo:
+    def __init__(self, cliente_id, fps, width, height, total):
+        self.cliente_id = cliente_id
+        self.total = total
+        self.output_path = os.path.join(
+            tempfile.gettempdir(),
+            f"video_procesado_{cliente_id.replace(':', '_')}_{int(time.time())}.mp4"
+        )
         
-        frame_size = int.from_bytes(size_data, byteorder='big')
+        self.writer = self._crear_writer(fps, width, height)
+        if not self.writer.isOpened():
+            raise RuntimeError("No se pudo crear VideoWriter")
         
-        if frame_size > MAX_PAYLOAD_SIZE:
-            log("WARNING", f"Payload demasiado grande: {frame_size} bytes")
-            return None
+        # Buffer de reordenamiento: frames ya procesados (aún comprimidos) que llegaron
+        # antes que su predecesor; se escriben en cuanto el hueco se completa.
+        # Su tamaño queda acotado por la admisión de la sesión (MAX_FRAMES_SESION)
+        self.pendientes = {}
+        self.siguiente = 0
+        self.hay_siguiente = asyncio.Event()
+        self.avance = asyncio.Event()
+        self.error = None
+        self.tarea = None
+        self.ultimo_frame = None
+    
+    def _crear_writer(self, fps, width, height):
+        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+        return cv2.VideoWriter(self.output_path, fourcc, fps, (width, height))
+    
+    def iniciar(self):
+        self.tarea = asyncio.create_task(self._bucle_escritura())
+    
+    def tiene(self, frame_id):
+        return frame_id < self.siguiente or frame_id in self.pendientes
+    
+    def agregar(self, frame_id, img_data):
+        if self.tiene(frame_id) or frame_id >= self.total:
+            return False
         
-        payload = b""
-        while len(payload) < frame_size:
-            packet = conn.recv(min(BUFFER_SIZE, frame_size - len(payload)))
-            if not packet:
-                return None
-            payload += packet
-            
-        return payload
-    except Exception as e:
-        log("ERROR", f"Error al recibir paquete: {e}")
-        return None
+        self.pendientes[frame_id] = img_data
+        
+        if frame_id == self.siguiente:
+            self.hay_siguiente.set()
+        return True
+    
+    def _escribir(self, frame_id, img_data):
+        nparr = np.frombuffer(img_data, np.uint8)
+        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        if frame is None:
+            log("ERROR", f"No se pudo decodificar frame {frame_id} de {self.cliente_id}")
+        else:
+            self.writer.write(frame)
+            self.ultimo_frame = frame
+    
+    def _repetir(self, frame_id, _):
+        if self.ultimo_frame is None:
+            log("ERROR", f"Frame {frame_id} de {self.cliente_id} marcado como repetido sin un frame anterior")
+            return
+        self.writer.write(self.ultimo_frame)
+    
+    async def _bucle_escritura(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self.siguiente < self.total:
+                while self.siguiente not in self.pendientes:
+                    self.hay_siguiente.clear()
+                    await self.hay_siguiente.wait()
+                
+                img_data = self.pendientes.pop(self.siguiente)
+                escribir = self._repetir if img_data is REPETIDO else self._escribir
+                await loop.run_in_executor(None, escribir, self.siguiente, img_data)
+                self.siguiente += 1
+                self.avance.set()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.error = e
+            log("ERROR", f"Error ensamblando video para {self.cliente_id}: {e}")
+        finally:
+            self.writer.release()
+    
+    async def esperar(self):
+        await self.tarea
+        return self.error is None
+    
+    async def cancelar(self):
+        self.pendientes.clear()
+        if self.tarea is not None and not self.tarea.done():
+            self.tarea.cancel()
+            try:
+                await self.tarea
+            except asyncio.CancelledError:
+                pass
+        if os.path.exists(self.output_path):
+            os.unlink(self.output_path)
 
-def enviar_paquete(conn, payload):
-    try:
-        size_bytes = len(payload).to_bytes(4, byteorder='big')
-        conn.sendall(size_bytes + payload)
+class EnsambladorFrames(EnsambladorVideo):
+    # Frames con codec negociado: la cabecera de cada frame indica cómo decodificarlo
+    def _escribir(self, frame_id, img_data):
+        try:
+            frame, _, _ = decodificar_frame(img_data)
+        except ValueError as e:
+            log("ERROR", f"No se pudo decodificar frame {frame_id} de {self.cliente_id}: {e}")
+            return
+        self.writer.write(frame)
+        self.ultimo_frame = frame
+
+class EnsambladorBandas(EnsambladorVideo):
+    # Cada frame llega en `bandas` unidades consecutivas: se decodifican sobre un único
+    # frame completo que se escribe al llegar su última banda
+    def __init__(self, cliente_id, fps, width, height, total, bandas):
+        super().__init__(cliente_id, fps, width, height, total)
+        self.bandas = bandas
+        self.limites = limites_bandas(height, bandas)
+        self.frame = np.zeros((height, width, 3), np.uint8)
+    
+    def _escribir(self, banda_id, img_data):
+        banda = banda_id % self.bandas
+        fila, fin = self.limites[banda]
+        try:
+            parte, _, _ = decodificar_frame(img_data)
+            if parte.shape != self.frame[fila:fin].shape:
+                raise ValueError(f"banda de {parte.shape[1]}x{parte.shape[0]}, se esperaba {self.frame.shape[1]}x{fin - fila}")
+            self.frame[fila:fin] = parte
+        except ValueError as e:
+            log("ERROR", f"No se pudo decodificar la banda {banda} del frame {banda_id // self.bandas} de {self.cliente_id}: {e}")
+        if banda == self.bandas - 1:
+            self.writer.write(self.frame)
+    
+    def _repetir(self, banda_id, _):
+        # El frame completo aún guarda las bandas del anterior
+        if banda_id % self.bandas == self.bandas - 1:
+            self.writer.write(self.frame)
+
+class EnsambladorSegmentos(EnsambladorVideo):
+    # Los nodos devuelven segmentos ya codificados: sus paquetes se copian al MP4
+    # final tal cual, sin decodificar ni recodificar en el broker
+    def _crear_writer(self, fps, width, height):
+        return crear_writer_remux(self.output_path, fps, width, height)
+    
+    def _escribir(self, segmento_id, datos):
+        try:
+            copiar_paquetes(datos, self.writer)
+        except ValueError as e:
+            log("ERROR", f"No se pudo copiar segmento {segmento_id} de {self.cliente_id}: {e}")
+
+class EnsambladorVivo:
+    # Modo en vivo: cada frame procesado se devuelve al cliente, en orden, en cuanto está listo.
+    # El plazo de un frame es su llegada al servidor más el presupuesto de latencia; si no
+    # llega a tiempo se descarta y se sigue con los posteriores que ya estén listos
+    def __init__(self, cliente_id, writer, presupuesto):
+        self.cliente_id = cliente_id
+        self.writer = writer
+        self.presupuesto = presupuesto
+        # Frames recibidos que aún no se han enviado ni descartado: id -> (llegada, plazo)
+        self.plazos = {}
+        self.pendientes = {}
+        self.siguiente = 0
+        self.recibidos = 0
+        self.terminado = False
+        self.hay_siguiente = asyncio.Event()
+        self.avance = asyncio.Event()
+        self.latencias = collections.deque(maxlen=MUESTRAS_LATENCIA_VIVO)
+        self.enviados = 0
+        self.descartados = 0
+        self.error = None
+        self.tarea = None
+    
+    def iniciar(self):
+        self.tarea = asyncio.create_task(self._bucle_envio())
+    
+    def registrar_llegada(self, frame_id):
+        # Los ids crecen; un hueco (frame descartado en origen) simplemente se salta
+        if frame_id < self.recibidos:
+            return False
+        ahora = time.monotonic()
+        self.plazos[frame_id] = (ahora, ahora + self.presupuesto)
+        self.recibidos = frame_id + 1
+        self.hay_siguiente.set()
         return True
-    except Exception as e:
-        log("ERROR", f"Error al enviar paquete: {e}")
-        return False
+    
+    def terminar(self):
+        self.terminado = True
+        self.hay_siguiente.set()
+    
+    def tiene(self, frame_id):
+        return frame_id < self.siguiente or frame_id in self.pendientes
+    
+    def vencido(self, frame_id, margen=0.0):
+        plazo = self.plazos.get(frame_id)
+        return plazo is None or time.monotonic() + margen > plazo[1]
+    
+    def descartar(self, frame_id):
+        if self.plazos.pop(frame_id, None) is not None:
+            self.descartados += 1
+            self.hay_siguiente.set()
+    
+    def agregar(self, frame_id, img_data):
+        if frame_id not in self.plazos or self.tiene(frame_id):
+            return False
+        self.pendientes[frame_id] = img_data
+        if frame_id == self.siguiente:
+            self.hay_siguiente.set()
+        return True
+    
+    def _avanzar(self):
+        self.siguiente += 1
+        self.avance.set()
+    
+    async def _bucle_envio(self):
+        try:
+            while not (self.terminado and self.siguiente >= self.recibidos):
+                plazo = self.plazos.get(self.siguiente)
+                if plazo is None:
+                    # Descartado antes de enviarse a un nodo, o un id que el cliente no envió
+                    if self.siguiente < self.recibidos:
+                        self._avanzar()
+                    else:
+                        self.hay_siguiente.clear()
+                        await self.hay_siguiente.wait()
+                    continue
+                
+                llegada, limite = plazo
+                ahora = time.monotonic()
+                if ahora > limite:
+                    del self.plazos[self.siguiente]
+                    self.pendientes.pop(self.siguiente, None)
+                    self.descartados += 1
+                    self._avanzar()
+                    continue
+                
+                if self.siguiente not in self.pendientes:
+                    self.hay_siguiente.clear()
+                    try:
+                        await asyncio.wait_for(self.hay_siguiente.wait(), limite - ahora)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                
+                img_data = self.pendientes.pop(self.siguiente)
+                del self.plazos[self.siguiente]
+                cabecera = bytes([MSG_FRAME_VIVO]) + self.siguiente.to_bytes(4, byteorder='big')
+                if not await enviar_paquete_async(self.writer, cabecera, img_data):
+                    raise ConnectionError("el cliente no acepta más frames")
+                self.latencias.append(time.monotonic() - llegada)
+                self.enviados += 1
+                self._avanzar()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.error = e
+            log("ERROR", f"Error enviando frames en vivo a {self.cliente_id}: {e}")
+    
+    def resumen(self):
+        resumen = {'enviados': self.enviados, 'descartados': self.descartados, 'p50_ms': None, 'p99_ms': None}
+        if self.latencias:
+            p50, p99 = np.percentile(self.latencias, (50, 99))
+            resumen['p50_ms'] = p50 * 1000
+            resumen['p99_ms'] = p99 * 1000
+        return resumen
+    
+    async def esperar(self):
+        await self.tarea
+        return self.error is None
+    
+    async def cancelar(self):
+        self.pendientes.clear()
+        self.plazos.clear()
+        if self.tarea is not None and not self.tarea.done():
+            self.tarea.cancel()
+            try:
+                await self.tarea
+            except asyncio.CancelledError:
+                pass
 
-def ensamblar_video(frames_dict, fps, width, height, cliente_id):
-    try:
-        log("INFO", f"Ensamblando video para cliente {cliente_id}: {len(frames_dict)} frames")
+class Sesion:
+    def __init__(self, cliente_id, metadata):
+        self.cliente_id = cliente_id
+        self.metadata = metadata
+        # En vivo no hay número de frames conocido ni video final: ver transmitir_vivo
+        self.vivo = metadata.get('modo') == 'vivo'
+        self.presupuesto = max(float(metadata.get('presupuesto_ms', PRESUPUESTO_VIVO_MS)), 1.0) / 1000
+        self.total_frames = metadata.get('total_frames', 0)
         
-        output_path = f"/tmp/video_procesado_{cliente_id}_{int(time.time())}.mp4"
+        # La unidad de trabajo es un frame o, en modo segmentos, un segmento
+        # comprimido de frames_segmento frames consecutivos
+        self.segmentos = metadata.get('modo') == 'segmentos'
+        self.frames_por_unidad = max(1, int(metadata.get('frames_segmento', 1))) if self.segmentos else 1
+        # Codec negociado para los frames (None: JPEG sin cabecera de clientes antiguos)
+        self.codec = None if self.segmentos else metadata.get('codec')
         
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_path, fourcc, fps, (width, height))
+        # Los frames muy grandes con codec negociado se reparten en bandas horizontales:
+        # cada banda es una unidad de trabajo y el ensamblador recompone el frame. Solo los
+        # codecs sin compresión se recortan sin más; un frame comprimido habría que decodificarlo
+        # en el servidor y recodificar cada banda (CPU y una generación de pérdida más), así
+        # que solo se divide con BANDAS_COMPRIMIDAS
+        self.bandas = 1
+        if (BANDAS_ACTIVAS and not self.vivo and self.codec in CODECS
+                and (BANDAS_COMPRIMIDAS or CODECS[self.codec] in CODECS_SIN_COMPRESION)
+                and metadata['width'] * metadata['height'] >= MIN_PIXELES_BANDAS):
+            self.bandas = num_bandas(metadata['width'], metadata['height'], PIXELES_POR_BANDA)
         
-        if not out.isOpened():
-            log("ERROR", "No se pudo crear VideoWriter")
-            return None
+        self.total_unidades = math.ceil(self.total_frames / self.frames_por_unidad) * self.bandas
+        self.unidades = 'segmentos' if self.segmentos else 'frames'
+        self.max_admitidas = max(2, MAX_FRAMES_SESION // self.frames_por_unidad) * self.bandas
         
-        frame_ids = sorted(frames_dict.keys())
-        for frame_id in frame_ids:
-            frame = frames_dict[frame_id]
-            out.write(frame)
+        # Sin compresión los frames pesan mucho más: la admisión se limita también en bytes
+        if self.codec in CODECS and CODECS[self.codec] in CODECS_SIN_COMPRESION:
+            tam_unidad = max(tam_sin_comprimir(CODECS[self.codec], metadata['width'], metadata['height']) // self.bandas, 1)
+            self.max_admitidas = max(2 * self.bandas, min(self.max_admitidas, MAX_MEMORIA_SESION_MB * 1024 * 1024 // tam_unidad))
         
-        out.release()
-        log("INFO", f"Video ensamblado exitosamente: {output_path}")
+        # Frames repetidos (solo modo frames): el cliente envía solo su id y el ensamblador
+        # replica el resultado del anterior; el valor es el umbral de detección del cliente
+        self.repetidos = metadata.get('repetidos') is not None and self.codec is not None and not self.vivo
+        self.frames_repetidos = 0
         
-        with open(output_path, 'rb') as f:
-            video_bytes = f.read()
+        if self.segmentos:
+            self.tipo_mensaje = MSG_SEGMENTOS
+        elif self.bandas > 1:
+            self.tipo_mensaje = MSG_BANDAS
+        elif self.codec is not None:
+            self.tipo_mensaje = MSG_FRAMES_CODEC
+        else:
+            self.tipo_mensaje = MSG_LOTE
         
-        os.unlink(output_path)
+        self.ensamblador = None
+        self.unidades_procesadas = 0
+        self.completo = asyncio.Event()
+        self.inicio = time.time()
+        self.activa = True
+        self.unidades_recibidas = 0
+        self.tiempo_bloqueado = 0.0
+        # Motivo por el que la sesión falló sin que su trabajo llegue a procesarse, y desde
+        # cuándo no hay ningún nodo conectado que la admita
+        self.fallo = None
+        self.sin_nodo_desde = None
         
-        log("INFO", f"Video para cliente {cliente_id} listo ({len(video_bytes)} bytes)")
-        return video_bytes
+        # Copias de cada frame en vuelo (más de una si se reenvió especulativamente);
+        # gana la primera respuesta y las demás se descartan al llegar
+        self.copias_en_vuelo = {}
+        self.frames_especulados = 0
+        # Veces que cada unidad volvió con error de un nodo o superó PLAZO_FRAME
+        self.fallos_unidad = {}
+        self.respuestas_descartadas = 0
         
-    except Exception as e:
-        log("ERROR", f"Error ensamblando video: {e}")
+        # Hash de cada unidad enviada a los nodos, para guardar su resultado en la caché,
+        # y huellas de filtro de los nodos que han producido resultados de la sesión
+        self.claves_cache = {}
+        self.huellas = set()
+        self.unidades_cache = 0
+        
+        # Estado del planificador: cola propia, peso y prioridad, y el coste de
+        # cada unidad en píxeles para el reparto deficit round-robin
+        self.cola = collections.deque()
+        self.deficit = 0
+        self.peso = max(float(metadata.get('peso', 1.0)), 0.01)
+        # Una transmisión en vivo va por defecto por delante de los trabajos por lotes
+        prioridad = metadata.get('prioridad', PRIORIDAD_ALTA if self.vivo else PRIORIDAD_NORMAL)
+        self.prioridad = min(max(int(prioridad), PRIORIDAD_ALTA), PRIORIDAD_BAJA)
+        self.costo_unidad = max(metadata['width'] * metadata['height'] * self.frames_por_unidad // self.bandas, 1)
+        self.frames_despachados = 0
+        self.espera_cola_total = 0.0
+        self.espera_cola_max = 0.0
+    
+    def espera_cola_media(self):
+        if not self.frames_despachados:
+            return 0.0
+        return self.espera_cola_total / self.frames_despachados
+    
+    def frames_procesados(self):
+        return min(self.unidades_procesadas // self.bandas * self.frames_por_unidad, self.total_frames)
+    
+    async def esperar_admision(self):
+        # Unidades admitidas y aún no escritas = en cola + en vuelo + buffer de reordenamiento.
+        # Mientras no se lee del socket, el control de flujo TCP frena al cliente
+        if self.unidades_recibidas - self.ensamblador.siguiente < self.max_admitidas:
+            return
+        
+        inicio = time.monotonic()
+        while self.unidades_recibidas - self.ensamblador.siguiente >= self.max_admitidas and self.fallo is None:
+            self.ensamblador.avance.clear()
+            await self.ensamblador.avance.wait()
+        self.tiempo_bloqueado += time.monotonic() - inicio
+    
+    def copia_enviada(self, frame_id):
+        self.copias_en_vuelo[frame_id] = self.copias_en_vuelo.get(frame_id, 0) + 1
+    
+    def copia_terminada(self, frame_id):
+        copias = self.copias_en_vuelo.pop(frame_id, 1) - 1
+        if copias > 0:
+            self.copias_en_vuelo[frame_id] = copias
+        return copias
+    
+    def registrar_frame(self, frame_id, img_data):
+        if not self.activa:
+            return False
+        if not self.ensamblador.agregar(frame_id, img_data):
+            self.respuestas_descartadas += 1
+            return False
+        
+        self.unidades_procesadas += 1
+        if self.unidades_procesadas >= self.total_unidades:
+            self.completo.set()
+        return True
+    
+    def fallar(self, mensaje):
+        # Libera al bucle de recepción y a la espera del procesamiento; manejar_cliente
+        # termina de leer la subida y envía el error al cliente
+        self.fallo = mensaje
+        planificador.retirar(self)
+        self.completo.set()
+        self.ensamblador.avance.set()
+    
+    async def cerrar(self):
+        self.activa = False
+        await self.ensamblador.cancelar()
+
+class PlanificadorFrames:
+    # Una cola por sesión; entre sesiones de la misma clase de prioridad se
+    # reparte con deficit round-robin ponderado y las clases se atienden en orden estricto.
+    # El quantum de cada ronda es el frame más grande de la clase, así el reparto
+    # es justo en píxeles sin conceder ráfagas largas a sesiones de frames pequeños
+    def __init__(self):
+        self.activas = {clase: collections.deque() for clase in range(PRIORIDAD_ALTA, PRIORIDAD_BAJA + 1)}
+        self.pendientes = 0
+        self.esperando = collections.deque()
+    
+    def _puede_tomar(self, consumidor):
+        return any(consumidor.admite(sesion) for activas in self.activas.values() for sesion in activas)
+    
+    def _elegir_esperando(self, sesion=None, excluir=None):
+        # Entre los consumidores ociosos que admiten el trabajo pendiente se elige el que
+        # terminaría antes una unidad más (según su throughput medido), no el primero que llegó a esperar.
+        # Con miles de nodos recorrerlos todos por frame domina el event loop: se comparan solo
+        # los primeros MAX_CANDIDATOS_ESPERA en espera, y uno sin medidas (estimado 0) gana directamente
+        elegido = None
+        mejor = None
+        candidatos = 0
+        for i, (futuro, consumidor) in enumerate(self.esperando):
+            if futuro.done():
+                continue
+            if consumidor is not None:
+                if consumidor is excluir:
+                    continue
+                if not (consumidor.admite(sesion) if sesion is not None else self._puede_tomar(consumidor)):
+                    continue
+            estimado = consumidor.tiempo_estimado() if consumidor is not None else 0.0
+            if mejor is None or estimado < mejor:
+                elegido, mejor = i, estimado
+            candidatos += 1
+            if mejor == 0.0 or candidatos >= MAX_CANDIDATOS_ESPERA:
+                break
+        return elegido
+    
+    def _despertar(self, sesion=None):
+        i = self._elegir_esperando(sesion)
+        if i is None:
+            return
+        futuro, _ = self.esperando[i]
+        del self.esperando[i]
+        futuro.set_result(None)
+    
+    def _agregar(self, sesion, payload, al_frente):
+        if not sesion.activa:
+            return
+        if not sesion.cola:
+            self.activas[sesion.prioridad].append(sesion)
+        if al_frente:
+            sesion.cola.appendleft((payload, time.monotonic()))
+        else:
+            sesion.cola.append((payload, time.monotonic()))
+        self.pendientes += 1
+        self._despertar(sesion)
+    
+    def encolar(self, sesion, payload):
+        self._agregar(sesion, payload, False)
+    
+    def reencolar(self, sesion, payload):
+        self._agregar(sesion, payload, True)
+    
+    def retirar(self, sesion):
+        self.pendientes -= len(sesion.cola)
+        sesion.cola.clear()
+        activas = self.activas[sesion.prioridad]
+        if sesion in activas:
+            activas.remove(sesion)
+    
+    def purgar_vencidos(self, sesion):
+        # En vivo los frames se encolan en orden de llegada, y por tanto de plazo: los vencidos
+        # están al principio. Sin nodos que los tomen, la cola de una transmisión (que no pasa
+        # por la admisión) crecería sin límite; así queda acotada por presupuesto × fps
+        purgados = 0
+        while sesion.cola:
+            payload, _ = sesion.cola[0]
+            frame_id = int.from_bytes(payload[:4], byteorder='big')
+            if not sesion.ensamblador.vencido(frame_id):
+                break
+            sesion.cola.popleft()
+            self.pendientes -= 1
+            sesion.ensamblador.descartar(frame_id)
+            sesion.claves_cache.pop(frame_id, None)
+            purgados += 1
+        if purgados and not sesion.cola:
+            activas = self.activas[sesion.prioridad]
+            if sesion in activas:
+                activas.remove(sesion)
+            sesion.deficit = 0
+    
+    def vacio(self):
+        return self.pendientes == 0
+    
+    def hay_esperando(self):
+        return any(not futuro.done() for futuro, _ in self.esperando)
+    
+    def entregar(self, sesion, payload, excluir=None):
+        # Entrega un frame directamente a un consumidor ocioso distinto de `excluir`,
+        # sin pasar por las colas (usado para las copias especulativas)
+        i = self._elegir_esperando(sesion, excluir)
+        if i is None:
+            return False
+        futuro, _ = self.esperando[i]
+        del self.esperando[i]
+        futuro.set_result((sesion, payload))
+        return True
+    
+    def tomar_nowait(self, admite=None):
+        # `admite` filtra las sesiones que puede atender el consumidor (p. ej. solo los
+        # nodos con soporte de segmentos reciben trabajo de sesiones en modo segmentos)
+        for clase in sorted(self.activas):
+            activas = self.activas[clase]
+            if admite is not None and not any(admite(sesion) for sesion in activas):
+                continue
+            quantum = None
+            while activas:
+                sesion = activas[0]
+                if admite is not None and not admite(sesion):
+                    activas.rotate(-1)
+                    continue
+                if sesion.deficit < sesion.costo_unidad:
+                    if quantum is None:
+                        quantum = max(otra.costo_unidad for otra in activas)
+                    sesion.deficit += quantum * sesion.peso
+                    activas.rotate(-1)
+                    continue
+                
+                sesion.deficit -= sesion.costo_unidad
+                payload, encolado_en = sesion.cola.popleft()
+                self.pendientes -= 1
+                if not sesion.cola:
+                    activas.popleft()
+                    sesion.deficit = 0
+                
+                # En vivo no se envía a un nodo un frame vencido, ni uno que ni el nodo más rápido
+                # devolvería a tiempo si detrás espera otro más reciente (el último siempre se intenta,
+                # así el tiempo de servicio se sigue midiendo)
+                if sesion.vivo:
+                    frame_id = int.from_bytes(payload[:4], byteorder='big')
+                    if sesion.ensamblador.vencido(frame_id, servicio_minimo() if sesion.cola else 0.0):
+                        sesion.ensamblador.descartar(frame_id)
+                        sesion.claves_cache.pop(frame_id, None)
+                        if sesion.cola:
+                            sesion.deficit += sesion.costo_unidad
+                        # Si era la única sesión de la clase que admite el consumidor, rotar
+                        # entre las demás no terminaría nunca
+                        elif admite is not None and not any(admite(otra) for otra in activas):
+                            break
+                        continue
+                
+                espera = time.monotonic() - encolado_en
+                sesion.frames_despachados += 1
+                sesion.espera_cola_total += espera
+                sesion.espera_cola_max = max(sesion.espera_cola_max, espera)
+                return sesion, payload
         return None
+    
+    async def tomar(self, consumidor=None):
+        admite = consumidor.admite if consumidor is not None else None
+        while True:
+            item = self.tomar_nowait(admite)
+            if item is not None:
+                # Si queda trabajo, otro consumidor ocioso puede tomarlo
+                if self.pendientes:
+                    self._despertar()
+                return item
+            
+            futuro = asyncio.get_running_loop().create_future()
+            self.esperando.append((futuro, consumidor))
+            try:
+                item = await futuro
+            except asyncio.CancelledError:
+                if not futuro.done():
+                    self.esperando.remove((futuro, consumidor))
+                elif not futuro.cancelled() and futuro.result() is None and self.pendientes:
+                    self._despertar()
+                raise
+            if item is not None:
+                return item
+
+planificador = PlanificadorFrames()
+cache_resultados = CacheResultados(CACHE_RESULTADOS_MB * 1024 * 1024)
+# Se crea al arrancar el servidor (lee el directorio); None si está desactivada
+cache_videos = None
+
+async def enviar_progreso_cliente(writer, sesion):
+    procesados = sesion.frames_procesados()
+    total_frames = sesion.total_frames
+    
+    elapsed = time.time() - sesion.inicio
+    fps = procesados / elapsed if elapsed > 0 else 0.0
+    eta = (total_frames - procesados) / fps if fps > 0 else None
+    
+    progreso = {
+        'status': 'progress',
+        'procesados': procesados,
+        'total': total_frames,
+        'fps': fps,
+        'eta': eta
+    }
+    return await enviar_paquete_async(writer, json.dumps(progreso).encode('utf-8'))
 
-def manejar_cliente(conn, addr):
-    cliente_id = f"{addr[0]}:{addr[1]}"
+async def manejar_cliente(reader, writer, cliente_id):
     log("INFO", f"Cliente conectado: {cliente_id}")
+    loop = asyncio.get_running_loop()
     
     try:
-        metadata_payload = recibir_paquete(conn)
+        metadata_payload = await recibir_paquete_async(reader, MAX_PAYLOAD_SIZE)
         if not metadata_payload:
             log("ERROR", f"No se recibió metadata de {cliente_id}")
             return
         
         metadata = json.loads(metadata_payload.decode('utf-8'))
-        total_frames = metadata['total_frames']
+        total_frames = metadata.get('total_frames', 0)
         fps = metadata['fps']
         width = metadata['width']
         height = metadata['height']
         
-        log("INFO", f"Metadata recibida de {cliente_id}: {total_frames} frames, {fps} fps, {width}x{height}")
+        sesion = Sesion(cliente_id, metadata)
+        frames = f"{total_frames} frames, "
+        if sesion.vivo:
+            frames = "transmisión en vivo, "
+            modo = f", presupuesto de latencia {sesion.presupuesto * 1000:.0f} ms, codec {sesion.codec or 'jpeg sin cabecera'}"
+        elif sesion.segmentos:
+            modo = f", segmentos de {sesion.frames_por_unidad} frames"
+        elif sesion.codec is not None:
+            modo = f", codec {sesion.codec}"
+            if sesion.bandas > 1:
+                modo += f", {sesion.bandas} bandas por frame"
+            if sesion.repetidos:
+                modo += ", detección de frames repetidos"
+        else:
+            modo = ""
+        log("INFO", f"Metadata recibida de {cliente_id}: {frames}{fps} fps, {width}x{height}{modo}")
         
-        with lock_sesiones:
-            sesiones_clientes[cliente_id] = {
-                'conn': conn,
-                'metadata': metadata,
-                'frames': {},
-                'procesados': set()
-            }
+        if sesion.codec is not None and sesion.codec not in CODECS:
+            log("ERROR", f"Codec no soportado de {cliente_id}: {sesion.codec}")
+            error_msg = json.dumps({'status': 'error', 'message': f"Codec no soportado: {sesion.codec}"}).encode('utf-8')
+            await enviar_paquete_async(writer, error_msg)
+            return
         
-        frames_recibidos = 0
-        while frames_recibidos < total_frames:
-            payload = recibir_paquete(conn)
+        if not nodo_compatible(sesion):
+            log("ERROR", f"Sesión de {cliente_id} rechazada: {motivo_sin_nodo(sesion)}")
+            error_msg = json.dumps({'status': 'error', 'message': motivo_sin_nodo(sesion)}).encode('utf-8')
+            await enviar_paquete_async(writer, error_msg)
+            return
+        
+        if sesion.vivo:
+            await transmitir_vivo(reader, writer, sesion)
+            return
+        
+        # Un video ya procesado con los mismos parámetros para el mismo cliente se devuelve sin
+        # subirlo. El cliente que envía su hash espera la respuesta antes de empezar la subida;
+        # sin una clave de cliente válida la caché de videos no se usa
+        hash_video = metadata.get('hash_video')
+        ambito = metadata.get('clave_cache')
+        if not isinstance(ambito, str) or len(ambito) < MIN_LONGITUD_CLAVE_CACHE:
+            ambito = None
+        if hash_video is not None:
+            ruta = None
+            if cache_videos is not None and ambito is not None:
+                ruta = cache_videos.buscar(ambito, hash_video, parametros_video(sesion), huellas_nodos())
+            if ruta is not None:
+                video_size = os.path.getsize(ruta)
+                log("INFO", f"Video de {cliente_id} encontrado en caché ({video_size} bytes), se devuelve sin procesar")
+                ready_msg = json.dumps({'status': 'ready', 'size': video_size, 'cache': True}).encode('utf-8')
+                if await enviar_paquete_async(writer, ready_msg) and await enviar_archivo_async(writer, ruta):
+                    log("INFO", f"Video enviado exitosamente a {cliente_id}")
+                else:
+                    log("ERROR", f"Error enviando video en caché a {cliente_id}")
+                return
+            if not await enviar_paquete_async(writer, json.dumps({'status': 'subir'}).encode('utf-8')):
+                log("ERROR", f"Error pidiendo la subida a {cliente_id}")
+                return
+        
+        argumentos = (cliente_id, fps, width, height, sesion.total_unidades)
+        if sesion.segmentos:
+            clase_ensamblador = EnsambladorSegmentos
+        elif sesion.bandas > 1:
+            clase_ensamblador = EnsambladorBandas
+            argumentos += (sesion.bandas,)
+        elif sesion.codec is not None:
+            clase_ensamblador = EnsambladorFrames
+        else:
+            clase_ensamblador = EnsambladorVideo
+        try:
+            ensamblador = await loop.run_in_executor(None, clase_ensamblador, *argumentos)
+        except Exception as e:
+            log("ERROR", f"Error preparando ensamblado para {cliente_id}: {e}")
+            error_msg = json.dumps({'status': 'error', 'message': 'Error ensamblando video'}).encode('utf-8')
+            await enviar_paquete_async(writer, error_msg)
+            return
+        ensamblador.iniciar()
+        
+        sesion.ensamblador = ensamblador
+        sesiones_clientes[cliente_id] = sesion
+        enviar_progreso = bool(metadata.get('progreso', False))
+        
+        while sesion.unidades_recibidas < sesion.total_unidades:
+            await sesion.esperar_admision()
+            
+            payload = await recibir_paquete_async(reader, MAX_PAYLOAD_SIZE)
             if payload is None:
-                log("ERROR", f"Error recibiendo frame {frames_recibidos} de {cliente_id}")
-                break
+                log("ERROR", f"Error recibiendo {sesion.unidades} de {cliente_id} ({sesion.unidades_recibidas // sesion.bandas}/{sesion.total_unidades // sesion.bandas})")
+                return
             
-            cola_frames_entrada.put((cliente_id, payload))
-            frames_recibidos += 1
+            if sesion.fallo is not None:
+                # Se lee el resto de la subida sin procesarla, para que el cliente llegue a leer el error
+                sesion.unidades_recibidas += sesion.bandas
+                continue
+            
+            if sesion.repetidos and len(payload) == 4:
+                repetir_frame(sesion, int.from_bytes(payload, byteorder='big'))
+                sesion.unidades_recibidas += sesion.bandas
+            else:
+                if sesion.bandas > 1:
+                    try:
+                        partes = await loop.run_in_executor(None, dividir_frame, payload, sesion.bandas)
+                    except ValueError as e:
+                        log("ERROR", f"No se pudo dividir en bandas un frame de {cliente_id}: {e}")
+                        return
+                else:
+                    partes = (payload,)
+                for parte in partes:
+                    await despachar_unidad(sesion, parte)
+                sesion.unidades_recibidas += len(partes)
             
-            if frames_recibidos % 10 == 0:
-                log("INFO", f"Cliente {cliente_id}: {frames_recibidos}/{total_frames} frames recibidos")
+            recibidos = sesion.unidades_recibidas // sesion.bandas
+            if recibidos % 10 == 0:
+                log("INFO", f"Cliente {cliente_id}: {recibidos}/{sesion.total_unidades // sesion.bandas} {sesion.unidades} recibidos")
         
-        log("INFO", f"Cliente {cliente_id}: Todos los frames recibidos ({frames_recibidos}/{total_frames})")
+        log("INFO", f"Cliente {cliente_id}: Todos los {sesion.unidades} recibidos ({sesion.unidades_recibidas // sesion.bandas}/{sesion.total_unidades // sesion.bandas}, subida frenada {sesion.tiempo_bloqueado:.1f} s por control de flujo)")
         
         log("INFO", f"Esperando procesamiento completo para {cliente_id}...")
         while True:
-            with lock_sesiones:
-                if cliente_id not in sesiones_clientes:
-                    log("ERROR", f"Sesión de {cliente_id} eliminada prematuramente")
-                    return
-                
-                procesados = len(sesiones_clientes[cliente_id]['procesados'])
-                
-            if procesados >= total_frames:
-                log("INFO", f"Todos los frames de {cliente_id} han sido procesados ({procesados}/{total_frames})")
+            try:
+                await asyncio.wait_for(sesion.completo.wait(), INTERVALO_PROGRESO if enviar_progreso else None)
                 break
-            
-            time.sleep(0.5)
+            except asyncio.TimeoutError:
+                if not await enviar_progreso_cliente(writer, sesion):
+                    log("ERROR", f"Error enviando progreso a {cliente_id}")
+                    return
         
-        with lock_sesiones:
-            frames_dict = sesiones_clientes[cliente_id]['frames']
+        if sesion.fallo is not None:
+            error_msg = json.dumps({'status': 'error', 'message': sesion.fallo}).encode('utf-8')
+            await enviar_paquete_async(writer, error_msg)
+            return
         
-        video_bytes = ensamblar_video(frames_dict, fps, width, height, cliente_id)
+        log("INFO", f"Todos los frames de {cliente_id} han sido procesados ({total_frames}/{total_frames})")
+        if enviar_progreso:
+            await enviar_progreso_cliente(writer, sesion)
         
-        if video_bytes is None:
+        if not await ensamblador.esperar():
             log("ERROR", f"Error ensamblando video para {cliente_id}")
             error_msg = json.dumps({'status': 'error', 'message': 'Error ensamblando video'}).encode('utf-8')
-            enviar_paquete(conn, error_msg)
+            await enviar_paquete_async(writer, error_msg)
             return
         
-        ready_msg = json.dumps({'status': 'ready', 'size': len(video_bytes)}).encode('utf-8')
-        if not enviar_paquete(conn, ready_msg):
+        video_size = os.path.getsize(ensamblador.output_path)
+        log("INFO", f"Video ensamblado exitosamente: {ensamblador.output_path} ({video_size} bytes)")
+        
+        ready_msg = json.dumps({'status': 'ready', 'size': video_size}).encode('utf-8')
+        if not await enviar_paquete_async(writer, ready_msg):
             log("ERROR", f"Error enviando mensaje READY a {cliente_id}")
             return
         
         log("INFO", f"Enviando video completo a {cliente_id}...")
-        if not enviar_paquete(conn, video_bytes):
+        if not await enviar_archivo_async(writer, ensamblador.output_path):
             log("ERROR", f"Error enviando video a {cliente_id}")
             return
         
         log("INFO", f"Video enviado exitosamente a {cliente_id}")
         
+        # Solo se guarda un video producido entero por nodos con la misma huella de filtro conocida
+        if hash_video is not None and ambito is not None and cache_videos is not None and len(sesion.huellas) == 1 and None not in sesion.huellas:
+            try:
+                cache_videos.guardar(ambito, hash_video, parametros_video(sesion), next(iter(sesion.huellas)), ensamblador.output_path)
+            except OSError as e:
+                log("WARNING", f"No se pudo guardar en caché el video de {cliente_id}: {e}")
+    
     except Exception as e:
         log("ERROR", f"Error manejando cliente {cliente_id}: {e}")
     finally:
-        with lock_sesiones:
-            if cliente_id in sesiones_clientes:
-                del sesiones_clientes[cliente_id]
-        conn.close()
+        sesion = sesiones_clientes.pop(cliente_id, None)
+        if sesion is not None:
+            planificador.retirar(sesion)
+            log("INFO", f"Cliente {cliente_id}: espera media en cola {sesion.espera_cola_media() * 1000:.1f} ms (máx {sesion.espera_cola_max * 1000:.1f} ms)")
+            if sesion.frames_especulados:
+                log("INFO", f"Cliente {cliente_id}: {sesion.frames_especulados} frames reenviados especulativamente, {sesion.respuestas_descartadas} respuestas duplicadas descartadas")
+            if sesion.unidades_cache:
+                log("INFO", f"Cliente {cliente_id}: {sesion.unidades_cache} {sesion.unidades} servidos desde la caché sin pasar por los nodos")
+            if sesion.frames_repetidos:
+                log("INFO", f"Cliente {cliente_id}: {sesion.frames_repetidos}/{sesion.total_frames} frames repetidos replicados en el ensamblado sin subirse ni pasar por los nodos")
+            await sesion.cerrar()
+        writer.close()
         log("INFO", f"Cliente {cliente_id} desconectado")
 
-def manejar_nodo(conn, addr):
-    nodo_id = f"{addr[0]}:{addr[1]}"
-    log("INFO", f"Nodo conectado: {nodo_id}")
+async def transmitir_vivo(reader, writer, sesion):
+    # Sin admisión: la fuente no se frena. Lo que no cabe en el presupuesto se descarta
+    # en cola o al llegar su turno, así que lo retenido queda acotado por el plazo
+    cliente_id = sesion.cliente_id
+    sesion.ensamblador = EnsambladorVivo(cliente_id, writer, sesion.presupuesto)
+    sesion.ensamblador.iniciar()
+    sesiones_clientes[cliente_id] = sesion
     
-    with lock_nodos:
-        nodos_disponibles.append(conn)
+    # El cliente cierra su lado de escritura al terminar la transmisión
+    while True:
+        payload = await recibir_paquete_async(reader, MAX_PAYLOAD_SIZE)
+        if payload is None:
+            break
+        if sesion.fallo is not None:
+            error_msg = json.dumps({'status': 'error', 'message': sesion.fallo}).encode('utf-8')
+            await enviar_paquete_async(writer, error_msg)
+            return
+        frame_id = int.from_bytes(payload[:4], byteorder='big')
+        if not sesion.ensamblador.registrar_llegada(frame_id):
+            log("WARNING", f"Frame {frame_id} de {cliente_id} fuera de orden, se ignora")
+            continue
+        planificador.purgar_vencidos(sesion)
+        await despachar_unidad(sesion, payload)
+        sesion.unidades_recibidas += 1
     
-    frames_procesados = 0
-    frame_actual = None
+    sesion.ensamblador.terminar()
+    if not await sesion.ensamblador.esperar():
+        return
     
-    try:
-        while True:
-            try:
-                cliente_id, payload = cola_frames_entrada.get(timeout=QUEUE_TIMEOUT)
-                frame_id = int.from_bytes(payload[:4], byteorder='big')
+    resumen = sesion.ensamblador.resumen()
+    latencia = f"latencia p50 {resumen['p50_ms']:.1f} ms, p99 {resumen['p99_ms']:.1f} ms" if resumen['enviados'] else "sin frames enviados"
+    log("INFO", f"Transmisión en vivo de {cliente_id} terminada: {resumen['enviados']} frames enviados, {resumen['descartados']} descartados por plazo, {latencia}")
+    fin_msg = json.dumps(dict(resumen, status='fin')).encode('utf-8')
+    await enviar_paquete_async(writer, fin_msg)
+
+def nodo_compatible(sesion):
+    # Sin ningún nodo conectado la sesión espera a que llegue alguno
+    return not nodos_disponibles or any(nodo.admite(sesion) for nodo in nodos_disponibles)
+
+def motivo_sin_nodo(sesion):
+    if sesion.segmentos:
+        requisito = "modo segmentos"
+    elif sesion.bandas > 1:
+        requisito = "frames en bandas"
+    else:
+        requisito = f"codec {sesion.codec}"
+    return f"Ningún nodo conectado admite sesiones con {requisito}"
+
+def huellas_nodos():
+    # Huellas de filtro distintas de los nodos conectados, sin contar los que no la anuncian
+    return list(dict.fromkeys(nodo.huella for nodo in nodos_disponibles if nodo.huella is not None))
+
+def parametros_video(sesion):
+    # Lo que, además del video original y el filtro, determina el resultado
+    return {
+        'modo': sesion.metadata.get('modo'),
+        'frames_segmento': sesion.frames_por_unidad,
+        'codec': sesion.codec,
+        'calidad': sesion.metadata.get('calidad'),
+        'bandas': sesion.bandas,
+        'repetidos': sesion.metadata.get('repetidos') if sesion.repetidos else None
+    }
+
+def repetir_frame(sesion, frame_id):
+    # Un frame repetido no va a los nodos: todas sus unidades se resuelven en el ensamblador
+    for unidad_id in range(frame_id * sesion.bandas, (frame_id + 1) * sesion.bandas):
+        sesion.registrar_frame(unidad_id, REPETIDO)
+    sesion.frames_repetidos += 1
+
+async def despachar_unidad(sesion, payload):
+    # Una unidad cuyo contenido ya procesó un nodo con el filtro de alguno de los nodos
+    # conectados se resuelve desde la caché sin pasar por el planificador
+    if not cache_resultados.activa():
+        planificador.encolar(sesion, payload)
+        return
+    
+    datos = memoryview(payload)[4:]
+    if datos.nbytes > UMBRAL_HASH_EXECUTOR:
+        digest = await asyncio.get_running_loop().run_in_executor(None, hash_contenido, datos)
+    else:
+        digest = hash_contenido(datos)
+    
+    unidad_id = int.from_bytes(payload[:4], byteorder='big')
+    resultado, huella = cache_resultados.buscar(digest, huellas_nodos(), datos.nbytes)
+    if resultado is not None:
+        sesion.huellas.add(huella)
+        if sesion.registrar_frame(unidad_id, resultado):
+            sesion.unidades_cache += 1
+        return
+    
+    sesion.claves_cache[unidad_id] = digest
+    planificador.encolar(sesion, payload)
+
+def ewma(actual, muestra):
+    if actual is None:
+        return muestra
+    return (1 - ALFA_EWMA) * actual + ALFA_EWMA * muestra
+
+def servicio_minimo():
+    # Lo mínimo que tardaría un frame en volver: el tiempo de servicio del nodo más rápido
+    return min((nodo.servicio_ewma for nodo in nodos_disponibles if nodo.servicio_ewma is not None), default=0.0)
+
+def reencolar_si_pendiente(sesion, frame_id, payload):
+    # Si otra copia sigue en vuelo o el frame ya llegó no hace falta reencolarlo
+    if sesion.copia_terminada(frame_id) == 0 and sesion.activa and not sesion.ensamblador.tiene(frame_id):
+        planificador.reencolar(sesion, payload)
+        return True
+    return False
+
+def reintentar_unidad(sesion, frame_id, payload, motivo):
+    # Una unidad que un nodo no pudo procesar o que superó el plazo se reencola, salvo que
+    # ya haya fallado MAX_FALLOS_UNIDAD veces: entonces en vivo se descarta el frame y en
+    # otro caso la sesión falla, en lugar de reintentarla sin fin (p. ej. un frame corrupto)
+    if sesion.copia_terminada(frame_id) > 0 or not sesion.activa or sesion.fallo is not None or sesion.ensamblador.tiene(frame_id):
+        return
+    fallos = sesion.fallos_unidad.get(frame_id, 0) + 1
+    sesion.fallos_unidad[frame_id] = fallos
+    if fallos < MAX_FALLOS_UNIDAD:
+        planificador.reencolar(sesion, payload)
+        return
+    
+    log("ERROR", f"Unidad {frame_id} de {sesion.cliente_id} falló {fallos} veces ({motivo}), no se reintenta")
+    if sesion.vivo:
+        sesion.ensamblador.descartar(frame_id)
+        sesion.claves_cache.pop(frame_id, None)
+    else:
+        sesion.fallar(f"La unidad {frame_id} falló {fallos} veces en los nodos: {motivo}")
+
+class ConexionNodo:
+    def __init__(self, writer, nodo_id, capacidad, lotes=False, latidos=False, ventana_max=VENTANA_MAX_NODO, nucleos=None, segmentos=False, codecs=False, bandas=False, huella=None):
+        self.writer = writer
+        self.nodo_id = nodo_id
+        self.capacidad = capacidad
+        self.nucleos = nucleos
+        self.lotes = lotes
+        self.latidos = latidos
+        self.segmentos = segmentos
+        self.codecs = codecs
+        self.bandas = bandas
+        # Versión y parámetros del filtro del nodo; sin ella sus resultados no se cachean
+        self.huella = huella
+        # Anillo en memoria compartida (nodos en el mismo host): slots libres y
+        # slot de cada tarea. El slot de una tarea vencida no se reutiliza hasta
+        # que el nodo responde, porque aún podría escribir en él
+        self.anillo = None
+        self.anillo_activo = False
+        self.slots_libres = []
+        self.slots_tarea = {}
+        self.ultima_recepcion = time.monotonic()
+        self.ventana_max = max(1, min(ventana_max, VENTANA_MAX_NODO))
+        self.ventana_min = min(max(capacidad, VENTANA_MIN_NODO), self.ventana_max)
+        self.ventana = self.ventana_min
+        self.en_vuelo = {}
+        # Tareas que superaron PLAZO_FRAME (y cuándo): ya se reencolaron, pero siguen ocupando
+        # la ventana hasta que el nodo responda, o hasta otro PLAZO_FRAME; así un nodo
+        # atascado no recibe más trabajo y uno que perdió una respuesta no queda bloqueado
+        self.tareas_vencidas = {}
+        self.credito = asyncio.Event()
+        self.latencias = collections.deque(maxlen=MUESTRAS_LATENCIA)
+        # Tiempo de servicio (envío → respuesta) e intervalo entre respuestas con el
+        # nodo ocupado; la inversa del intervalo es su throughput en frames/s
+        self.servicio_ewma = None
+        self.intervalo_ewma = None
+        self.ultima_respuesta = None
+        self.frames_procesados = 0
+    
+    def admite(self, sesion):
+        if sesion.segmentos:
+            return self.segmentos
+        if sesion.bandas > 1:
+            return self.bandas
+        return self.codecs or sesion.codec is None
+    
+    async def _tomar_lote(self, disponibles):
+        item = await planificador.tomar(self)
+        lote = [item]
+        # Los segmentos ya son unidades grandes: van de uno en uno
+        if not self.lotes or item[0].segmentos:
+            return lote
+        
+        # Con frames en vuelo el nodo sigue ocupado, así que se puede esperar
+        # hasta LOTE_MAX_ESPERA para completar el lote; si está ocioso no se espera.
+        # Un lote solo lleva unidades del mismo tipo (JPEG sin cabecera, frames con codec o bandas)
+        tipo = item[0].tipo_mensaje
+        tam_lote = len(item[1])
+        esperado = not self.en_vuelo
+        while len(lote) < disponibles and tam_lote < LOTE_MAX_BYTES:
+            if planificador.vacio():
+                if esperado:
+                    break
+                esperado = True
+                try:
+                    await asyncio.sleep(LOTE_MAX_ESPERA)
+                except asyncio.CancelledError:
+                    # El nodo se desconectó durante la espera: las unidades ya tomadas aún no
+                    # están en en_vuelo, así que nadie más las reencolaría. Se devuelven al
+                    # frente de sus colas en el orden original
+                    for sesion, payload in reversed(lote):
+                        planificador.reencolar(sesion, payload)
+                    raise
+                continue
+            item = planificador.tomar_nowait(
+                lambda sesion: self.admite(sesion) and sesion.tipo_mensaje == tipo
+            )
+            if item is None:
+                break
+            lote.append(item)
+            tam_lote += len(item[1])
+        return lote
+    
+    async def bucle_envio(self):
+        try:
+            while True:
+                while len(self.en_vuelo) + len(self.tareas_vencidas) >= self.ventana:
+                    self.credito.clear()
+                    await self.credito.wait()
+                disponibles = self.ventana - len(self.en_vuelo) - len(self.tareas_vencidas)
                 
-                log("INFO", f"Nodo {nodo_id} → Procesando Frame ID: {frame_id}")
+                lote = await self._tomar_lote(disponibles)
                 
-                with lock_frames_proceso:
-                    frames_en_proceso[frame_id] = (nodo_id, cliente_id, payload)
+                entradas = []
+                ahora = time.monotonic()
+                for sesion, payload in lote:
+                    frame_id = int.from_bytes(payload[:4], byteorder='big')
+                    tarea_id = nueva_tarea_id()
+                    
+                    if not self.en_vuelo:
+                        self.ultima_respuesta = ahora
+                    self.en_vuelo[tarea_id] = (sesion, frame_id, ahora, payload)
+                    sesion.copia_enviada(frame_id)
+                    entradas.append((tarea_id, frame_id, payload))
                 
-                frame_actual = (frame_id, cliente_id, payload)
+                if lote[0][0].segmentos:
+                    tarea_id, segmento_id, payload = entradas[0]
+                    log("INFO", f"Nodo {self.nodo_id} → Procesando segmento ID: {segmento_id} ({len(payload) - 4} bytes)")
+                    mensaje = self._mensaje_lote(entradas, MSG_SEGMENTOS)
+                elif self.lotes:
+                    log("INFO", f"Nodo {self.nodo_id} → Procesando lote de {len(entradas)} frames (IDs {entradas[0][1]}..{entradas[-1][1]})")
+                    mensaje = self._mensaje_lote(entradas, lote[0][0].tipo_mensaje)
+                else:
+                    tarea_id, frame_id, payload = entradas[0]
+                    log("INFO", f"Nodo {self.nodo_id} → Procesando Frame ID: {frame_id}")
+                    mensaje = [tarea_id.to_bytes(4, byteorder='big'), memoryview(payload)[4:]]
                 
-            except queue.Empty:
-                continue
-            
-            if not enviar_paquete(conn, payload):
-                log("ERROR", f"Error enviando frame a nodo {nodo_id}")
-                if frame_actual:
-                    cola_frames_entrada.put((frame_actual[1], frame_actual[2]))
-                    with lock_frames_proceso:
-                        if frame_actual[0] in frames_en_proceso:
-                            del frames_en_proceso[frame_actual[0]]
+                if not await enviar_paquete_async(self.writer, *mensaje):
+                    log("ERROR", f"Error enviando frame a nodo {self.nodo_id}")
+                    return
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log("ERROR", f"Error en envío a nodo {self.nodo_id}: {e}")
+        finally:
+            self.writer.close()
+    
+    def _mensaje_lote(self, entradas, tipo):
+        # Con el anillo activo los datos se copian a slots y por el socket solo van
+        # el tipo y el índice de cada slot; si no cabe algún frame o faltan slots, va por TCP
+        if (self.anillo_activo and len(self.slots_libres) >= len(entradas)
+                and all(self.anillo.cabe(len(payload) - 4) for _, _, payload in entradas)):
+            cuerpos = []
+            for tarea_id, _, payload in entradas:
+                slot = self.slots_libres.pop()
+                self.anillo.escribir(slot, memoryview(payload)[4:])
+                self.slots_tarea[tarea_id] = slot
+                cuerpos.append((tarea_id, ENTRADA_SLOT.pack(tipo, slot)))
+            return partes_lote(cuerpos, MSG_SLOTS)
+        return partes_lote([(tarea_id, memoryview(payload)[4:]) for tarea_id, _, payload in entradas], tipo)
+    
+    def ofrecer_anillo(self):
+        # Un slot por frame en vuelo. Solo se usa si el nodo confirma que pudo
+        # adjuntarse, es decir, que de verdad comparte la máquina con el servidor
+        try:
+            self.anillo = AnilloFrames.crear(self.ventana_max, TAM_SLOT_ANILLO)
+        except OSError as e:
+            log("WARNING", f"No se pudo crear memoria compartida para el nodo {self.nodo_id}: {e}")
+            return
+        oferta = json.dumps({'nombre': self.anillo.nombre, 'slots': self.anillo.num_slots, 'tam_slot': self.anillo.tam_slot}).encode('utf-8')
+        paquete = bytes([MSG_ANILLO]) + oferta
+        self.writer.write(len(paquete).to_bytes(4, byteorder='big') + paquete)
+    
+    def confirmar_anillo(self, payload):
+        try:
+            aceptado = bool(json.loads(bytes(payload[1:]).decode('utf-8')).get('ok', False))
+        except (ValueError, AttributeError):
+            aceptado = False
+        if aceptado and self.anillo is not None:
+            self.anillo_activo = True
+            self.slots_libres = list(range(self.anillo.num_slots))
+            log("INFO", f"Nodo {self.nodo_id} usa memoria compartida ({self.anillo.num_slots} slots de {self.anillo.tam_slot // (1024 * 1024)} MB)")
+        else:
+            log("INFO", f"Nodo {self.nodo_id} no pudo adjuntarse a la memoria compartida; se usa TCP")
+            self.cerrar_anillo()
+    
+    def cerrar_anillo(self):
+        self.anillo_activo = False
+        self.slots_libres = []
+        self.slots_tarea.clear()
+        if self.anillo is not None:
+            self.anillo.cerrar()
+            self.anillo = None
+    
+    def recoger_resultado(self, tarea_id, img_data):
+        # Una respuesta vacía indica que el nodo dejó el resultado en el slot de la tarea;
+        # se copia fuera para liberar el slot en el acto
+        slot = self.slots_tarea.pop(tarea_id, None)
+        if slot is None:
+            return img_data
+        if not len(img_data):
+            img_data = bytes(self.anillo.leer(slot))
+        self.slots_libres.append(slot)
+        return img_data
+    
+    def registrar_respuesta(self, tarea_id):
+        ahora = time.monotonic()
+        tarea = self.en_vuelo.pop(tarea_id, None)
+        if tarea is None:
+            if self.tareas_vencidas.pop(tarea_id, None) is not None:
+                self.credito.set()
+            return None
+        sesion, frame_id, enviado_en, _ = tarea
+        sesion.copia_terminada(frame_id)
+        
+        servicio = ahora - enviado_en
+        self.latencias.append(servicio)
+        latencias_frames.append(servicio)
+        self.servicio_ewma = ewma(self.servicio_ewma, servicio)
+        if self.ultima_respuesta is not None:
+            self.intervalo_ewma = ewma(self.intervalo_ewma, ahora - self.ultima_respuesta)
+        self.ultima_respuesta = ahora if self.en_vuelo else None
+        
+        if VENTANA_ADAPTATIVA:
+            self._ajustar_ventana()
+        self.credito.set()
+        
+        return sesion, frame_id
+    
+    def registrar_error(self, tarea_id):
+        # El nodo no pudo procesar la tarea: libera su hueco en la ventana y su slot del anillo
+        slot = self.slots_tarea.pop(tarea_id, None)
+        if slot is not None:
+            self.slots_libres.append(slot)
+        tarea = self.en_vuelo.pop(tarea_id, None)
+        if tarea is None:
+            if self.tareas_vencidas.pop(tarea_id, None) is not None:
+                self.credito.set()
+            return None
+        
+        sesion, frame_id, _, payload = tarea
+        if not self.en_vuelo:
+            self.ultima_respuesta = None
+        self.credito.set()
+        return sesion, frame_id, payload
+    
+    def throughput(self):
+        if not self.intervalo_ewma:
+            return None
+        return 1.0 / self.intervalo_ewma
+    
+    def tiempo_estimado(self):
+        # Cuánto tardaría en devolver un frame más: al menos su tiempo de servicio,
+        # o el turno del frame tras los que ya tiene en vuelo. Sin medidas aún cuenta
+        # como inmediato para que los nodos nuevos reciban trabajo y se midan
+        if self.servicio_ewma is None:
+            return 0.0
+        estimado = self.servicio_ewma
+        if self.intervalo_ewma:
+            estimado = max(estimado, (len(self.en_vuelo) + 1) * self.intervalo_ewma)
+        return estimado
+    
+    def enviar_latido(self):
+        # Sin drain: el paquete es mínimo y la vigilancia no debe quedar esperando a un nodo
+        self.writer.write(len(LATIDO).to_bytes(4, byteorder='big') + LATIDO)
+    
+    def sin_respuesta(self, ahora):
+        # Un nodo con latidos debe contestar aunque esté ocioso; a uno sin ellos
+        # solo se le exige respuesta mientras tiene frames en vuelo
+        if self.latidos:
+            return ahora - self.ultima_recepcion > TIMEOUT_NODO
+        return self.ultima_respuesta is not None and ahora - self.ultima_respuesta > TIMEOUT_NODO
+    
+    def vencer_tareas(self, ahora):
+        vencidas = []
+        for tarea_id, (_, _, enviado_en, _) in self.en_vuelo.items():
+            if ahora - enviado_en <= PLAZO_FRAME:
                 break
-            
-            payload_procesado = recibir_paquete(conn)
+            vencidas.append(tarea_id)
+        
+        for tarea_id in vencidas:
+            sesion, frame_id, _, payload = self.en_vuelo.pop(tarea_id)
+            self.tareas_vencidas[tarea_id] = ahora
+            log("WARNING", f"Frame {frame_id} de {sesion.cliente_id} superó el plazo de {PLAZO_FRAME:.0f} s en nodo {self.nodo_id}")
+            reintentar_unidad(sesion, frame_id, payload, "plazo superado")
+        
+        if vencidas and not self.en_vuelo:
+            self.ultima_respuesta = None
+        
+        # Pasado otro PLAZO_FRAME sin respuesta el hueco se recupera (el slot del anillo no:
+        # el nodo aún podría escribir en él)
+        recuperadas = [tarea_id for tarea_id, vencida_en in self.tareas_vencidas.items() if ahora - vencida_en > PLAZO_FRAME]
+        for tarea_id in recuperadas:
+            del self.tareas_vencidas[tarea_id]
+        if recuperadas:
+            log("WARNING", f"Nodo {self.nodo_id} no respondió {len(recuperadas)} tareas vencidas en {2 * PLAZO_FRAME:.0f} s; se liberan sus huecos en la ventana")
+            self.credito.set()
+    
+    def _ajustar_ventana(self):
+        # Producto latencia mínima x throughput (frames necesarios para no dejar ocioso al nodo)
+        # más un margen de un frame por worker
+        if not self.intervalo_ewma:
+            return
+        objetivo = math.ceil(min(self.latencias) / self.intervalo_ewma) + self.capacidad
+        self.ventana = max(self.ventana_min, min(objetivo, self.ventana_max))
+
+def es_host_local(writer):
+    # La memoria compartida solo se ofrece a nodos que conectan desde la propia máquina
+    remoto = writer.get_extra_info('peername')
+    local = writer.get_extra_info('sockname')
+    if not remoto or not local:
+        return False
+    try:
+        return ipaddress.ip_address(remoto[0]).is_loopback or remoto[0] == local[0]
+    except ValueError:
+        return False
+
+async def manejar_nodo(reader, writer, nodo_id, identificacion="NODO"):
+    capacidad = 1
+    nucleos = None
+    ventana_max = VENTANA_MAX_NODO
+    lotes = False
+    latidos = False
+    segmentos = False
+    codecs = False
+    bandas = False
+    memoria = False
+    huella = None
+    
+    if identificacion == "NODO_V2":
+        capacidades_payload = await recibir_paquete_async(reader, MAX_PAYLOAD_SIZE)
+        if capacidades_payload is None:
+            log("ERROR", f"No se recibieron capacidades del nodo {nodo_id}")
+            writer.close()
+            return
+        try:
+            capacidades = json.loads(capacidades_payload.decode('utf-8'))
+            if capacidades.get('nucleos') is not None:
+                nucleos = max(1, int(capacidades['nucleos']))
+            capacidad = max(1, int(capacidades.get('workers', nucleos or 1)))
+            if capacidades.get('ventana_max') is not None:
+                ventana_max = max(1, int(capacidades['ventana_max']))
+            lotes = bool(capacidades.get('lotes', False))
+            latidos = lotes and bool(capacidades.get('latidos', False))
+            segmentos = lotes and bool(capacidades.get('segmentos', False))
+            codecs = lotes and bool(capacidades.get('codecs', False))
+            bandas = codecs and bool(capacidades.get('bandas', False))
+            memoria = lotes and bool(capacidades.get('memoria_compartida', False))
+            if capacidades.get('filtro') is not None:
+                huella = str(capacidades['filtro'])
+        except (ValueError, TypeError, AttributeError) as e:
+            log("WARNING", f"Capacidades inválidas del nodo {nodo_id}: {e}")
+    
+    nodo = ConexionNodo(writer, nodo_id, capacidad, lotes, latidos, ventana_max, nucleos, segmentos, codecs, bandas, huella)
+    log("INFO", f"Nodo conectado: {nodo_id} ({capacidad} workers, ventana inicial {nodo.ventana}, máxima {nodo.ventana_max})")
+    if MEMORIA_COMPARTIDA and memoria and es_host_local(writer):
+        nodo.ofrecer_anillo()
+    
+    nodos_disponibles.append(nodo)
+    tarea_envio = asyncio.create_task(nodo.bucle_envio())
+    
+    try:
+        while True:
+            payload_procesado = await recibir_paquete_async(reader, MAX_PAYLOAD_SIZE)
             if payload_procesado is None:
-                log("ERROR", f"Nodo {nodo_id} no respondió")
-                if frame_actual:
-                    cola_frames_entrada.put((frame_actual[1], frame_actual[2]))
-                    with lock_frames_proceso:
-                        if frame_actual[0] in frames_en_proceso:
-                            del frames_en_proceso[frame_actual[0]]
+                if not tarea_envio.done():
+                    log("ERROR", f"Nodo {nodo_id} no respondió")
                 break
             
-            frame_id_proc = int.from_bytes(payload_procesado[:4], byteorder='big')
-            img_data = payload_procesado[4:]
-            nparr = np.frombuffer(img_data, np.uint8)
-            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            log("INFO", f"Nodo {nodo_id} ← Frame ID: {frame_id_proc} completado")
-            
-            with lock_sesiones:
-                if cliente_id in sesiones_clientes:
-                    sesiones_clientes[cliente_id]['frames'][frame_id_proc] = frame
-                    sesiones_clientes[cliente_id]['procesados'].add(frame_id_proc)
-                    frames_procesados += 1
-            
-            with lock_frames_proceso:
-                if frame_id_proc in frames_en_proceso:
-                    del frames_en_proceso[frame_id_proc]
+            nodo.ultima_recepcion = time.monotonic()
+            if nodo.lotes:
+                if es_latido(payload_procesado):
+                    continue
+                if payload_procesado[0] == MSG_ANILLO:
+                    nodo.confirmar_anillo(payload_procesado)
+                    continue
+                if payload_procesado[0] == MSG_ERROR_TAREA:
+                    for tarea_id, motivo in desempaquetar_lote(payload_procesado):
+                        tarea = nodo.registrar_error(tarea_id)
+                        if tarea is None:
+                            continue
+                        sesion, frame_id_proc, payload = tarea
+                        motivo = bytes(motivo).decode('utf-8', 'replace')
+                        log("WARNING", f"Nodo {nodo_id} no pudo procesar la unidad {frame_id_proc} de {sesion.cliente_id}: {motivo}")
+                        reintentar_unidad(sesion, frame_id_proc, payload, motivo)
+                    continue
+                entradas = desempaquetar_lote(payload_procesado)
+            else:
+                entradas = [(int.from_bytes(payload_procesado[:4], byteorder='big'), memoryview(payload_procesado)[4:])]
             
-            frame_actual = None
+            completados = []
+            for tarea_id, img_data in entradas:
+                img_data = nodo.recoger_resultado(tarea_id, img_data)
+                tarea = nodo.registrar_respuesta(tarea_id)
+                if tarea is None:
+                    log("WARNING", f"Nodo {nodo_id} devolvió una tarea desconocida o vencida ({tarea_id})")
+                    continue
+                sesion, frame_id_proc = tarea
+                
+                digest = sesion.claves_cache.pop(frame_id_proc, None)
+                if sesion.registrar_frame(frame_id_proc, img_data):
+                    nodo.frames_procesados += 1
+                    sesion.huellas.add(nodo.huella)
+                    if digest is not None:
+                        cache_resultados.guardar(digest, nodo.huella, img_data)
+                completados.append(frame_id_proc)
             
+            if len(completados) == 1:
+                log("INFO", f"Nodo {nodo_id} ← ID {completados[0]} completado")
+            elif completados:
+                log("INFO", f"Nodo {nodo_id} ← Lote de {len(completados)} frames completado")
+    
     except Exception as e:
         log("ERROR", f"Error con nodo {nodo_id}: {e}")
     finally:
-        if frame_actual:
-            log("WARNING", f"Nodo {nodo_id} desconectado con frame {frame_actual[0]} en proceso, reencolado")
-            cola_frames_entrada.put((frame_actual[1], frame_actual[2]))
-            with lock_frames_proceso:
-                if frame_actual[0] in frames_en_proceso:
-                    del frames_en_proceso[frame_actual[0]]
-        
-        frames_perdidos = []
-        with lock_frames_proceso:
-            for fid, (nid, cid, payload) in list(frames_en_proceso.items()):
-                if nid == nodo_id:
-                    frames_perdidos.append((fid, cid, payload))
-                    del frames_en_proceso[fid]
-        
-        for fid, cid, payload in frames_perdidos:
-            log("WARNING", f"Reencolando frame {fid} del nodo desconectado {nodo_id}")
-            cola_frames_entrada.put((cid, payload))
-        
-        with lock_nodos:
-            if conn in nodos_disponibles:
-                nodos_disponibles.remove(conn)
-        conn.close()
-        log("INFO", f"Nodo {nodo_id} desconectado (procesó {frames_procesados} frames en total)")
-
-def aceptar_conexiones():
-    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((BROKER_HOST, BROKER_PORT))
-    server_socket.listen(5)
+        tarea_envio.cancel()
+        try:
+            await tarea_envio
+        except asyncio.CancelledError:
+            pass
+        
+        for sesion, fid, _, payload in nodo.en_vuelo.values():
+            if reencolar_si_pendiente(sesion, fid, payload):
+                log("WARNING", f"Reencolando frame {fid} del nodo desconectado {nodo_id}")
+        nodo.en_vuelo.clear()
+        nodo.cerrar_anillo()
+        
+        if nodo in nodos_disponibles:
+            nodos_disponibles.remove(nodo)
+        writer.close()
+        log("INFO", f"Nodo {nodo_id} desconectado (procesó {nodo.frames_procesados} frames en total, ventana final {nodo.ventana})")
+
+def buscar_rezagados(umbral):
+    ahora = time.monotonic()
+    rezagados = []
+    for nodo in nodos_disponibles:
+        # en_vuelo conserva el orden de envío: en cuanto un frame no supera el umbral, los siguientes tampoco
+        for sesion, frame_id, enviado_en, payload in nodo.en_vuelo.values():
+            if ahora - enviado_en < umbral:
+                break
+            if sesion.activa and sesion.copias_en_vuelo.get(frame_id) == 1 and not sesion.ensamblador.tiene(frame_id):
+                rezagados.append((enviado_en, nodo, sesion, frame_id, payload))
+    rezagados.sort(key=lambda rezagado: rezagado[0])
+    return rezagados
+
+async def vigilar_rezagados():
+    # Cuando la cola se vacía y hay nodos ociosos, los frames que llevan en vuelo
+    # más que el percentil de latencia (con margen) se reenvían a otro nodo
+    while True:
+        await asyncio.sleep(INTERVALO_REZAGADOS)
+        if not planificador.vacio() or not planificador.hay_esperando():
+            continue
+        if len(latencias_frames) < MIN_MUESTRAS_REZAGADO:
+            continue
+        
+        umbral = np.percentile(latencias_frames, PERCENTIL_REZAGADO) * FACTOR_REZAGADO
+        for enviado_en, nodo, sesion, frame_id, payload in buscar_rezagados(umbral):
+            if not planificador.entregar(sesion, payload, excluir=nodo):
+                break
+            sesion.frames_especulados += 1
+            log("WARNING", f"Frame {frame_id} de {sesion.cliente_id} lleva {time.monotonic() - enviado_en:.2f} s en nodo {nodo.nodo_id} (umbral {umbral:.2f} s); reenviado a un nodo ocioso")
+
+async def vigilar_nodos():
+    # Latidos periódicos y plazos por frame. Un nodo que calla más de TIMEOUT_NODO se
+    # da por caído: se aborta su conexión y manejar_nodo reencola sus frames en vuelo
+    while True:
+        await asyncio.sleep(INTERVALO_LATIDO)
+        ahora = time.monotonic()
+        for nodo in list(nodos_disponibles):
+            if nodo.writer.is_closing():
+                continue
+            if nodo.sin_respuesta(ahora):
+                log("ERROR", f"Nodo {nodo.nodo_id} sin respuesta en {TIMEOUT_NODO:.0f} s, se desconecta ({len(nodo.en_vuelo)} frames en vuelo)")
+                nodo.writer.transport.abort()
+                continue
+            
+            nodo.vencer_tareas(ahora)
+            if nodo.latidos:
+                nodo.enviar_latido()
+        
+        # Una sesión que ningún nodo conectado admite (p. ej. solo quedan nodos antiguos) no
+        # avanzaría nunca: pasado ESPERA_NODO_COMPATIBLE se da por fallida
+        for sesion in list(sesiones_clientes.values()):
+            if sesion.fallo is not None or nodo_compatible(sesion):
+                sesion.sin_nodo_desde = None
+            elif sesion.sin_nodo_desde is None:
+                sesion.sin_nodo_desde = ahora
+            elif ahora - sesion.sin_nodo_desde >= ESPERA_NODO_COMPATIBLE:
+                log("ERROR", f"Sesión de {sesion.cliente_id} sin nodos compatibles en {ESPERA_NODO_COMPATIBLE:.0f} s: {motivo_sin_nodo(sesion)}")
+                sesion.fallar(motivo_sin_nodo(sesion))
+
+async def aceptar_conexion(reader, writer):
+    addr = writer.get_extra_info('peername')
+    conexion_id = f"{addr[0]}:{addr[1]}"
     
-    log("INFO", f"Servidor central escuchando en {BROKER_HOST}:{BROKER_PORT}")
+    try:
+        identificacion = await reader.readexactly(10)
+    except (asyncio.IncompleteReadError, ConnectionError):
+        writer.close()
+        return
+    
+    id_str = identificacion.decode('utf-8', errors='replace').strip()
     
+    if id_str == "CLIENTE":
+        await manejar_cliente(reader, writer, conexion_id)
+    elif id_str in ("NODO", "NODO_V2"):
+        await manejar_nodo(reader, writer, conexion_id, id_str)
+    else:
+        log("WARNING", f"ID desconocida: {id_str}")
+        writer.close()
+
+async def mostrar_estadisticas():
     while True:
-        try:
-            conn, addr = server_socket.accept()
-            
-            identificacion = recibir_bytes_exactos(conn, 10)
-            if not identificacion:
-                conn.close()
+        await asyncio.sleep(INTERVALO_ESTADISTICAS)
+        log("INFO", f"Estadísticas: {len(sesiones_clientes)} clientes activos, {len(nodos_disponibles)} nodos disponibles, {planificador.pendientes} frames en cola")
+        for sesion in sesiones_clientes.values():
+            if sesion.vivo:
+                resumen = sesion.ensamblador.resumen()
+                latencia = f", latencia p50 {resumen['p50_ms']:.1f} ms, p99 {resumen['p99_ms']:.1f} ms" if resumen['enviados'] else ""
+                log("INFO", f"  Sesión {sesion.cliente_id} en vivo: {len(sesion.cola)} frames en cola, {resumen['enviados']} enviados, {resumen['descartados']} descartados{latencia}")
                 continue
-                
-            id_str = identificacion.decode('utf-8').strip()
-            
-            if id_str == "CLIENTE":
-                t = threading.Thread(target=manejar_cliente, args=(conn, addr), daemon=True)
-                t.start()
-            elif id_str == "NODO":
-                t = threading.Thread(target=manejar_nodo, args=(conn, addr), daemon=True)
-                t.start()
-            else:
-                log("WARNING", f"ID desconocida: {id_str}")
-                conn.close()
-                
-        except Exception as e:
-            log("ERROR", f"Error aceptando conexión: {e}")
+            repetidos = f", {sesion.frames_repetidos} repetidos" if sesion.frames_repetidos else ""
+            log("INFO", f"  Sesión {sesion.cliente_id}: {len(sesion.cola)} {sesion.unidades} en cola, {sesion.frames_procesados()}/{sesion.total_frames} frames procesados{repetidos}, espera media {sesion.espera_cola_media() * 1000:.1f} ms")
+        for nodo in nodos_disponibles:
+            servicio = f"{nodo.servicio_ewma * 1000:.1f} ms" if nodo.servicio_ewma is not None else "sin medir"
+            throughput = f"{nodo.throughput():.1f} frames/s" if nodo.throughput() is not None else "throughput sin medir"
+            nucleos = f", {nodo.nucleos} núcleos" if nodo.nucleos else ""
+            log("INFO", f"  Nodo {nodo.nodo_id}: {nodo.capacidad} workers{nucleos}, ventana {nodo.ventana}/{nodo.ventana_max}, {len(nodo.en_vuelo)} en vuelo, servicio {servicio}, {throughput}, {nodo.frames_procesados} procesados")
+        if cache_resultados.activa():
+            log("INFO", f"  Caché de resultados: {len(cache_resultados.entradas)} entradas, {cache_resultados.bytes / (1024 * 1024):.1f}/{CACHE_RESULTADOS_MB} MB, aciertos {cache_resultados.tasa_aciertos() * 100:.1f}% ({cache_resultados.aciertos}/{cache_resultados.aciertos + cache_resultados.fallos}), {cache_resultados.bytes_ahorrados / (1024 * 1024):.1f} MB de tráfico con nodos evitado")
+        if cache_videos is not None:
+            log("INFO", f"  Caché de videos: {len(cache_videos.videos)} videos, {cache_videos.bytes / (1024 * 1024):.1f}/{CACHE_VIDEOS_MB} MB, {cache_videos.aciertos} aciertos, {cache_videos.fallos} fallos, {cache_videos.bytes_ahorrados / (1024 * 1024):.1f} MB servidos sin procesar")
+
+async def servidor():
+    global cache_videos
+    if CACHE_VIDEOS_MB > 0:
+        cache_videos = CacheVideos(DIRECTORIO_CACHE_VIDEOS, CACHE_VIDEOS_MB * 1024 * 1024)
+        log("INFO", f"Caché de videos en {DIRECTORIO_CACHE_VIDEOS}: {len(cache_videos.videos)} videos, {cache_videos.bytes / (1024 * 1024):.1f} MB")
+    
+    server = await asyncio.start_server(
+        aceptar_conexion, BROKER_HOST, BROKER_PORT, backlog=LISTEN_BACKLOG
+    )
+    log("INFO", f"Servidor central escuchando en {BROKER_HOST}:{BROKER_PORT}")
+    
+    tareas = [asyncio.create_task(mostrar_estadisticas()), asyncio.create_task(vigilar_nodos())]
+    if ESPECULACION_ACTIVA:
+        tareas.append(asyncio.create_task(vigilar_rezagados()))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        for tarea in tareas:
+            tarea.cancel()
 
 def main():
     log("INFO", "=== Sistema Distribuido de Procesamiento de Video ===")
     log("INFO", "Iniciando servidor central...")
     
-    t = threading.Thread(target=aceptar_conexiones, daemon=True)
-    t.start()
-    
     try:
-        while True:
-            time.sleep(10)
-            with lock_sesiones:
-                num_clientes = len(sesiones_clientes)
-            with lock_nodos:
-                num_nodos = len(nodos_disponibles)
-            
-            log("INFO", f"Estadísticas: {num_clientes} clientes activos, {num_nodos} nodos disponibles")
+        asyncio.run(servidor())
     except KeyboardInterrupt:
         log("INFO", "Servidor detenido por usuario")
 
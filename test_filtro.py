@@ -0,0 +1,26 @@
+import numpy as np
+from Nodo_Procesamiento import CineFilter
+from benchmark_filtro import FiltroOriginal, frame_prueba
+
+# CineFilter (LUT combinada y viñeta en punto fijo) frente al filtro original en coma
+# flotante: la salida no puede separarse más de 1 nivel por canal, barras incluidas
+RESOLUCIONES = ((320, 240), (854, 480), (1280, 720), (1920, 1080), (321, 241), (641, 359), (17, 9))
+
+def test_filtro_dentro_de_un_nivel():
+    for width, height in RESOLUCIONES:
+        original = FiltroOriginal(width, height)
+        actual = CineFilter(width, height)
+        for semilla in range(2):
+            frame = frame_prueba(width, height, semilla)
+            esperado = original.apply_cinematic_style(frame)
+            obtenido = actual.apply_cinematic_style(frame)
+            assert obtenido.shape == esperado.shape and obtenido.dtype == np.uint8
+            diferencia = np.abs(obtenido.astype(np.int16) - esperado).max()
+            assert diferencia <= 1, f"{width}x{height}: diferencia máxima {diferencia}"
+
+def test_barras_en_negro():
+    for width, height in RESOLUCIONES:
+        frame = np.full((height, width, 3), 255, np.uint8)
+        esperado = FiltroOriginal(width, height).apply_cinematic_style(frame)
+        obtenido = CineFilter(width, height).apply_cinematic_style(frame)
+        assert np.array_equal(esperado == 0, obtenido == 0), f"{width}x{height}: las barras no coinciden"
\ No newline at end of file
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import types
+import servidor_central
+from servidor_central import MAX_FALLOS_UNIDAD, PLAZO_FRAME, PRIORIDAD_ALTA, ConexionNodo, PlanificadorFrames, Sesion
+
+# Casos límite del planificador y del envío a nodos, sin sockets: el nodo usa un
+# writer que no escribe y las sesiones solo se encolan en un planificador nuevo
+
+class WriterNulo:
+    def is_closing(self):
+        return False
+    
+    def close(self):
+        pass
+
+def nueva_sesion(**metadata):
+    sesion = Sesion('cliente', {'total_frames': 10, 'width': 64, 'height': 48, **metadata})
+    sesion.ensamblador = types.SimpleNamespace(tiene=lambda frame_id: False, avance=asyncio.Event())
+    return sesion
+
+def unidad(frame_id):
+    return frame_id.to_bytes(4, byteorder='big') + b'frame'
+
+def test_lote_cancelado_se_reencola(monkeypatch):
+    # Un nodo que se desconecta mientras espera a completar un lote devuelve lo ya tomado
+    planificador = PlanificadorFrames()
+    monkeypatch.setattr(servidor_central, 'planificador', planificador)
+    
+    async def escenario():
+        nodo = ConexionNodo(WriterNulo(), 'nodo', 1, lotes=True)
+        nodo.en_vuelo[0] = None
+        sesion = nueva_sesion()
+        planificador.encolar(sesion, unidad(1))
+        tarea = asyncio.create_task(nodo._tomar_lote(4))
+        await asyncio.sleep(0)
+        tarea.cancel()
+        try:
+            await tarea
+        except asyncio.CancelledError:
+            pass
+        return sesion
+    
+    sesion = asyncio.run(escenario())
+    assert planificador.pendientes == 1
+    assert [bytes(payload) for payload, _ in sesion.cola] == [unidad(1)]
+def test_unidad_que_siempre_falla_hace_fallar_la_sesion(monkeypatch):
+    # Un frame que ningún nodo puede procesar se reintenta MAX_FALLOS_UNIDAD - 1 veces y no más
+    planificador = PlanificadorFrames()
+    monkeypatch.setattr(servidor_central, 'planificador', planificador)
+    nodo = ConexionNodo(WriterNulo(), 'nodo', 1, lotes=True)
+    sesion = nueva_sesion()
+    
+    for intento in range(MAX_FALLOS_UNIDAD):
+        nodo.en_vuelo[intento] = (sesion, 5, 0.0, unidad(5))
+        sesion.copia_enviada(5)
+        if intento:
+            planificador.tomar_nowait()
+        sesion_error, frame_id, payload = nodo.registrar_error(intento)
+        servidor_central.reintentar_unidad(sesion_error, frame_id, payload, 'corrupto')
+    
+    assert sesion.fallo is not None and 'corrupto' in sesion.fallo
+    assert planificador.pendientes == 0 and not nodo.en_vuelo
+
+def test_hueco_vencido_se_recupera(monkeypatch):
+    # Una tarea vencida ocupa la ventana del nodo hasta que responda, pero no más de otro PLAZO_FRAME
+    monkeypatch.setattr(servidor_central, 'planificador', PlanificadorFrames())
+    nodo = ConexionNodo(WriterNulo(), 'nodo', 1, lotes=True)
+    nodo.en_vuelo[1] = (nueva_sesion(), 0, 0.0, unidad(0))
+    
+    nodo.vencer_tareas(PLAZO_FRAME + 1)
+    assert not nodo.en_vuelo and 1 in nodo.tareas_vencidas
+    nodo.vencer_tareas(2 * PLAZO_FRAME + 1)
+    assert 1 in nodo.tareas_vencidas
+    nodo.vencer_tareas(2 * PLAZO_FRAME + 2)
+    assert not nodo.tareas_vencidas and nodo.credito.is_set()
+def test_descarte_en_vivo_sin_otras_sesiones_admitidas():
+    # El último frame de una transmisión en vivo está vencido y el resto de su clase es de
+    # sesiones que el consumidor no admite: tomar_nowait debe devolver None, no girar sin fin
+    planificador = PlanificadorFrames()
+    vivo = nueva_sesion(modo='vivo')
+    vivo.ensamblador.vencido = lambda frame_id, margen=0.0: True
+    vivo.ensamblador.descartar = lambda frame_id: None
+    lotes = nueva_sesion(codec='jpeg', prioridad=PRIORIDAD_ALTA)
+    planificador.encolar(vivo, unidad(0))
+    planificador.encolar(lotes, unidad(0))
+    
+    # En un hilo aparte: si vuelve a girar sin fin, la prueba falla en lugar de colgarse
+    resultado = []
+    hilo = threading.Thread(target=lambda: resultado.append(planificador.tomar_nowait(lambda sesion: sesion.codec is None)), daemon=True)
+    hilo.start()
+    hilo.join(5)
+    assert resultado == [None]
+    assert not vivo.cola and len(lotes.cola) == 1
\ No newline at end of file